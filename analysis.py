@@ -1,11 +1,37 @@
 import streamlit as st
 from google.api_core import exceptions as google_exceptions
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
+from llm_client import RequestScheduler, StreamTimer, generate_text, estimate_tokens, format_timing, CHARS_PER_TOKEN
+from metrics import timed
+from comparison import ComparisonEngine
+from semantic_search import SearchIndex
+from library import get_library
+import re
 
-def analyze_research_paper(chat_session, prompt: str) -> str:
+# Papers longer than this are condensed map-reduce style before being analyzed or summarized
+SUMMARY_CHUNK_TOKENS = 6000
+# Sections shorter than this fraction of the chunk budget are not sent on their own
+MIN_CHUNK_SHARE = 0.125
+
+# Numbered headings ("3.2 Data Collection") and the usual unnumbered section names
+SECTION_HEADING = re.compile(
+    r"^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+[A-Z][^\n]{0,80}"
+    r"|(?:abstract|introduction|background|related work|methods?|methodology|materials and methods|experiments?"
+    r"|results|discussion|conclusions?|limitations|future work|references|bibliography|acknowledge?ments|appendix)\b[^\n]{0,40})[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+SUMMARY_PROMPT = "Provide a concise summary of the following research paper, highlighting the main research question, methodology, key findings, and conclusions:"
+CONDENSED_SUMMARY_PROMPT = "The following are summaries of consecutive parts of one research paper. Combine them into a concise summary of the whole paper, highlighting the main research question, methodology, key findings, and conclusions:"
+CHUNK_SUMMARY_PROMPT = "Summarize this part of a research paper. Keep the research question, methods, numbers, findings and conclusions it contains:"
+
+# One-shot tasks (analysis, comparison, summary, related papers) are independent
+# generate_content calls, so no chat history is sent or accumulated for them
+# on_chunk, if given, streams the response: it is called with the text received so far
+@timed("analyze_research_paper")
+def analyze_research_paper(model, prompt: str, on_chunk: Optional[Callable[[str], None]] = None) -> str:
     try:
-        response = chat_session.send_message(prompt)
-        return response.text
+        return generate_text(model, prompt, on_chunk)
     except google_exceptions.GoogleAPIError as e:
         st.error(f"An error occurred while analyzing the paper: {str(e)}")
         return None
@@ -13,68 +39,181 @@ def analyze_research_paper(chat_session, prompt: str) -> str:
         st.error(f"An unexpected error occurred: {str(e)}")
         return None
 
-def analyze_papers(chat_session, papers: List[Dict[str, Any]], focus_areas: List[str], output_format: str) -> List[Dict[str, Any]]:
+def split_into_sections(text: str) -> List[str]:
+    starts = [match.start() for match in SECTION_HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    sections = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+    return [section for section in sections if section.strip()]
+
+def chunk_paper(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[str]:
+    # Each section is its own chunk, so an edit inside one section leaves the other
+    # chunks (and their cached summaries) unchanged. Sections shorter than MIN_CHUNK_SHARE
+    # of the budget are carried into the next one; that depends only on their own length,
+    # so boundaries elsewhere do not move. Oversized sections are split at the last
+    # paragraph break that fits, else the last line break, else the last space.
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    pending = ""
+    for section in split_into_sections(text):
+        pending += section
+        if len(pending) < max_chars * MIN_CHUNK_SHARE:
+            continue
+        while len(pending) > max_chars:
+            cut = -1
+            for sep in ("\n\n", "\n", " "):
+                cut = pending.rfind(sep, max_chars // 2, max_chars)
+                if cut > 0:
+                    break
+            cut = cut if cut > 0 else max_chars
+            chunks.append(pending[:cut])
+            pending = pending[cut:]
+        chunks.append(pending)
+        pending = ""
+    if pending:
+        chunks.append(pending)
+    return chunks
+
+def condense_papers(model, contents: List[str], scheduler: Optional[RequestScheduler] = None,
+                    max_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[tuple]:
+    # Map: the chunks of every over-long paper are summarized concurrently in one batch,
+    # repeating on the joined summaries until each text fits in one prompt. Chunk summaries
+    # go through the response cache, whose key covers the chunk text, so after an edit only
+    # the changed chunks are sent to the model again. Returns (text, error) per input.
+    scheduler = scheduler or RequestScheduler()
+    results = [(content, None) for content in contents]
+    done = set()
+    while True:
+        pending = [i for i, (content, error) in enumerate(results)
+                   if error is None and i not in done and estimate_tokens(content) > max_tokens]
+        if not pending:
+            return results
+        jobs = [(i, chunk) for i in pending for chunk in chunk_paper(results[i][0], max_tokens)]
+        outputs = scheduler.run([lambda chunk=chunk: generate_text(model, f"{CHUNK_SUMMARY_PROMPT}\n\n{chunk}") for _, chunk in jobs])
+        summaries = {i: [] for i in pending}
+        errors = {}
+        for (i, _), (summary, error) in zip(jobs, outputs):
+            if error:
+                errors.setdefault(i, error)
+            elif summary:
+                summaries[i].append(summary)
+        for i in pending:
+            if i in errors:
+                results[i] = (None, errors[i])
+                continue
+            condensed = "\n\n".join(summaries[i])
+            if len(condensed) >= len(results[i][0]):
+                # Summarizing stopped shrinking the text, so cut it to the budget rather
+                # than sending an over-long prompt
+                results[i] = (results[i][0][:max_tokens * CHARS_PER_TOKEN], None)
+                done.add(i)
+                continue
+            results[i] = (condensed, None)
+
+def condense_paper(model, paper_content: str, scheduler: Optional[RequestScheduler] = None,
+                   max_tokens: int = SUMMARY_CHUNK_TOKENS) -> str:
+    content, error = condense_papers(model, [paper_content], scheduler, max_tokens)[0]
+    if error:
+        raise error
+    return content
+
+def build_analysis_prompt(paper: Dict[str, Any], focus_areas: List[str], output_format: str,
+                          content: Optional[str] = None) -> str:
+    analysis_prompt = f"Analyze the following research paper content. Focus on: {', '.join(focus_areas)}. Format the output as {output_format}."
+    return f"{analysis_prompt}\n\n{content if content is not None else paper['content']}"
+
+def analyze_papers(model, papers: List[Dict[str, Any]], focus_areas: List[str], output_format: str,
+                   stream: bool = False, scheduler: Optional[RequestScheduler] = None) -> List[Dict[str, Any]]:
+    # scheduler paces the chunk summaries of papers that have to be condensed first
     analysis_results = []
     progress_bar = st.progress(0)
     for i, paper in enumerate(papers):
         st.write(f"Analyzing paper: {paper['name']}")
         st.write(f"Paper content length: {len(paper['content'])} characters")
         with st.spinner(f"Analyzing {paper['name']}..."):
-            analysis_prompt = f"Analyze the following research paper content. Focus on: {', '.join(focus_areas)}. Format the output as {output_format}."
-            analysis = analyze_research_paper(chat_session, f"{analysis_prompt}\n\n{paper['content'][:1000]}...")  # Limit content for logging
+            try:
+                content = condense_paper(model, paper['content'], scheduler)
+            except Exception as e:
+                st.error(f"An error occurred while condensing {paper['name']}: {str(e)}")
+                content = None
+            analysis = None
+            if content:
+                prompt = build_analysis_prompt(paper, focus_areas, output_format, content)
+                if stream:
+                    # Render the analysis as it arrives instead of waiting for the whole response
+                    placeholder = st.empty()
+                    timer = StreamTimer(placeholder.markdown, "analysis")
+                    analysis = analyze_research_paper(model, prompt, timer)
+                    placeholder.empty()
+                    st.caption(format_timing(timer.finish()))
+                else:
+                    analysis = analyze_research_paper(model, prompt)
             if analysis:
-                analysis_results.append({"name": paper['name'], "analysis": analysis, "content": paper['content']})
+                analysis_results.append({"id": paper.get('id'), "name": paper['name'], "analysis": analysis})
                 st.success(f"Analysis complete for {paper['name']}")
             else:
                 st.warning(f"No analysis generated for {paper['name']}")
         progress_bar.progress((i + 1) / len(papers))
     return analysis_results
 
-def compare_papers(chat_session, analysis_results):
+# Each paper is an independent generate_content call, so papers are analyzed concurrently
+# instead of queuing behind one shared chat session. Results keep the input order;
+# progress_callback(index, analysis, error) runs on the calling thread.
+def analyze_papers_concurrently(model, papers: List[Dict[str, Any]], focus_areas: List[str], output_format: str,
+                                scheduler: Optional[RequestScheduler] = None,
+                                progress_callback: Optional[Callable[[int, Optional[str], Optional[Exception]], None]] = None) -> List[Dict[str, Any]]:
+    scheduler = scheduler or RequestScheduler()
+    # Long papers are condensed first so the analysis sees the whole paper, not a prefix
+    condensed = condense_papers(model, [paper['content'] for paper in papers], scheduler)
+    results = [(None, error) for _, error in condensed]
+    tasks = []
+    task_indices = []
+    for i, (paper, (content, error)) in enumerate(zip(papers, condensed)):
+        if error:
+            if progress_callback:
+                progress_callback(i, None, error)
+            continue
+        prompt = build_analysis_prompt(paper, focus_areas, output_format, content)
+        tasks.append(lambda prompt=prompt: generate_text(model, prompt))
+        task_indices.append(i)
+
+    def on_done(task_index, analysis, error):
+        if progress_callback:
+            progress_callback(task_indices[task_index], analysis, error)
+
+    for i, result in zip(task_indices, scheduler.run(tasks, on_done=on_done)):
+        results[i] = result
+    return [
+        {"id": paper.get('id'), "name": paper['name'], "analysis": analysis}
+        for paper, (analysis, error) in zip(papers, results)
+        if analysis
+    ]
+
+def compare_papers(model, analysis_results, engine: Optional[ComparisonEngine] = None,
+                   index: Optional[SearchIndex] = None, scheduler: Optional[RequestScheduler] = None):
+    # Papers are grouped by the similarity of their text in index (built from the results
+    # when not given) and compared group by group; pass the same engine across calls so
+    # only new or changed groups go to the model
     if len(analysis_results) < 2:
         return "At least two papers are required for comparison."
+    engine = engine or ComparisonEngine()
+    if index is None:
+        index = SearchIndex()
+        # Results carry ids, names and analyses only; the paper text comes from the library
+        index.sync(get_library().get_papers([result['id'] for result in analysis_results]))
+    similarity = index.document_similarity([result['id'] for result in analysis_results])
+    comparison = engine.compare(model, analysis_results, similarity, scheduler)
+    for error in comparison["errors"]:
+        st.error(f"An error occurred while comparing the papers: {error}")
+    if comparison["errors"]:
+        st.info("Click Analyze again to retry the comparison.")
+    return comparison
 
-    paper_titles = [result['name'] for result in analysis_results]
-    prompt = f"""Compare and contrast the following papers: {', '.join(paper_titles)}. 
-    Provide a brief overview of each paper, then discuss:
-    1. Key similarities between the papers
-    2. Notable differences between the papers
-    3. Potential areas for future research based on these papers
-    
-    Format your response with clear headings for each section, but do not repeat the headings at the end."""
-
-    comparison = analyze_research_paper(chat_session, prompt)
-
-    # Split the comparison into sections
-    sections = comparison.split('\n\n')
-    result = {
-        "overview": "",
-        "similarities": "",
-        "differences": "",
-        "future_research": ""
-    }
-
-    current_section = "overview"
-    for section in sections:
-        if "Key similarities" in section:
-            current_section = "similarities"
-        elif "Notable differences" in section:
-            current_section = "differences"
-        elif "Potential areas for future research" in section:
-            current_section = "future_research"
-        
-        result[current_section] += section + "\n\n"
-
-    # Remove any trailing newlines and spaces
-    for key in result:
-        result[key] = result[key].strip()
-
-    return result
-
-def ask_question(chat_session, question: str) -> str:
+# qa_chat is a llm_client.QAChat; record_as is the text kept in its history for this turn
+def ask_question(qa_chat, question: str, record_as: Optional[str] = None,
+                 on_chunk: Optional[Callable[[str], None]] = None) -> str:
     try:
-        response = chat_session.send_message(question)
-        return response.text
+        return qa_chat.send(question, record_as=record_as, on_chunk=on_chunk)
     except google_exceptions.GoogleAPIError as e:
         st.error(f"An error occurred while answering the question: {str(e)}")
         return None
@@ -82,14 +221,30 @@ def ask_question(chat_session, question: str) -> str:
         st.error(f"An unexpected error occurred: {str(e)}")
         return None
 
-@st.cache_data
-def summarize_paper(_chat_session, paper_content: str) -> str:
-    summary_prompt = "Provide a concise summary of the following research paper, highlighting the main research question, methodology, key findings, and conclusions:"
-    return analyze_research_paper(_chat_session, f"{summary_prompt}\n\n{paper_content}")
+def build_summary_prompt(paper_content: str, condensed: bool = False) -> str:
+    if condensed:
+        # Reduce step over the chunk summaries produced by condense_paper
+        return f"{CONDENSED_SUMMARY_PROMPT}\n\n{paper_content}"
+    return f"{SUMMARY_PROMPT}\n\n{paper_content}"
+
+# Not wrapped in st.cache_data: on_chunk writes to a placeholder created outside the
+# function, which Streamlit cannot replay, and repeats are already answered by the
+# response cache. Errors are raised rather than reported, so a RequestScheduler running
+# this can retry them; the UI reports them itself.
+@timed("summarize_paper")
+def summarize_paper(model, paper_content: str, scheduler: Optional[RequestScheduler] = None,
+                    on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    condensed = estimate_tokens(paper_content) > SUMMARY_CHUNK_TOKENS
+    if condensed:
+        paper_content = condense_paper(model, paper_content, scheduler)
+    return generate_text(model, build_summary_prompt(paper_content, condensed), on_chunk)
 
-def find_related_papers(chat_session, analysis_results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+def find_related_papers(model, analysis_results: List[Dict[str, Any]], local_candidates: Optional[List[str]] = None) -> List[Dict[str, str]]:
     # Combine all analyses into one context
     combined_analysis = "\n\n".join([f"Paper: {r['name']}\nAnalysis: {r['analysis']}" for r in analysis_results])
+    if local_candidates:
+        # Works the citation index found to be cited across the library ground the suggestions
+        combined_analysis += "\n\nWorks frequently cited by these papers:\n" + "\n".join(f"- {c}" for c in local_candidates)
     
     prompt = f"""Based on the following analysis of research papers, suggest 5 related research papers that would be relevant for further reading. For each suggestion, provide the title and a URL where it can be found (use Google Scholar links if available).
 
@@ -99,7 +254,7 @@ def find_related_papers(chat_session, analysis_results: List[Dict[str, Any]]) ->
     - [Paper Title](URL)
     """
     
-    response = analyze_research_paper(chat_session, prompt)
+    response = analyze_research_paper(model, prompt)
     
     # Parse the response to extract paper titles and URLs
     related_papers = []
@@ -1,51 +1,61 @@
 import streamlit as st
-import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
-from pdf_utils import extract_text_from_pdf
-from analysis import analyze_papers, compare_papers, ask_question, summarize_paper, find_related_papers
-from citation import extract_citations, format_citation
-from semantic_search import perform_semantic_search, highlight_text
 from ui_layout import render_sidebar, render_main_content
-import time
+from llm_client import QAChat, build_model, configure_api
 
 # Page configuration
 st.set_page_config(layout="wide", page_title="Research Paper Analysis Assistant", page_icon="📚")
 
+# Streamlit reruns this script for every session and interaction, so the model object is
+# built once per process for each key and generation settings and shared by all sessions
+@st.cache_resource(show_spinner="Loading the model...")
+def get_model(api_key, temperature, max_tokens):
+    return build_model(temperature, max_tokens)
+
 # Initialize session state variables if they don't exist
 if 'api_key' not in st.session_state:
     st.session_state.api_key = ''
-if 'paper_contents' not in st.session_state:
-    st.session_state.paper_contents = []
+if 'paper_ids' not in st.session_state:
+    st.session_state.paper_ids = []
 if 'analysis_results' not in st.session_state:
     st.session_state.analysis_results = []
-if 'chat_session' not in st.session_state:
-    st.session_state.chat_session = None
+if 'qa_chat' not in st.session_state:
+    st.session_state.qa_chat = None
+if 'model' not in st.session_state:
+    st.session_state.model = None
 if 'uploaded_files' not in st.session_state:
     st.session_state.uploaded_files = None
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'dark_mode' not in st.session_state:
     st.session_state.dark_mode = False
+if 'search_index' not in st.session_state:
+    st.session_state.search_index = None
+if 'dense_index' not in st.session_state:
+    st.session_state.dense_index = None
+if 'citation_index' not in st.session_state:
+    st.session_state.citation_index = None
+if 'duplicate_index' not in st.session_state:
+    st.session_state.duplicate_index = None
+if 'comparison_engine' not in st.session_state:
+    st.session_state.comparison_engine = None
 
 # Sidebar for API key input and app information
 render_sidebar()
 
 # Main app logic
 if st.session_state.api_key:
-    genai.configure(api_key=st.session_state.api_key)
+    configure_api(st.session_state.api_key)
 
     try:
-        if st.session_state.chat_session is None:
-            model = genai.GenerativeModel(
-                model_name="gemini-1.5-flash",
-                generation_config={
-                    "temperature": st.session_state.ai_temperature,
-                    "top_p": 0.95,
-                    "top_k": 40,
-                    "max_output_tokens": st.session_state.max_tokens,
-                },
-            )
-            st.session_state.chat_session = model.start_chat(history=[])
+        model = get_model(st.session_state.api_key, st.session_state.ai_temperature, st.session_state.max_tokens)
+        if st.session_state.model is not model:
+            # New settings swap the model but keep the conversation
+            st.session_state.model = model
+            if st.session_state.qa_chat is None:
+                st.session_state.qa_chat = QAChat(model)
+            else:
+                st.session_state.qa_chat.model = model
 
         # Main content area
         render_main_content()
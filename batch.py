@@ -0,0 +1,187 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Set
+from analysis import analyze_papers_concurrently, build_summary_prompt, condense_papers, SUMMARY_CHUNK_TOKENS
+from cache_utils import hash_bytes, hash_text
+from citation import extract_citations, extract_references
+from library import get_library
+from llm_client import RequestScheduler, build_model, configure_api, estimate_tokens, generate_text
+from minhash import MinHasher, store_signature
+from pdf_utils import extract_pages_from_pdfs, join_pages, page_starts, DEFAULT_WORKERS
+
+# Headless counterpart of the Streamlit app for analyzing a folder of PDFs overnight.
+#
+#   python batch.py papers/ --output results.jsonl
+#
+# Each file gets one JSON line in the output, appended as soon as its batch finishes.
+# The output doubles as the checkpoint: a rerun skips every file whose SHA-256 already
+# has a successful line, so an interrupted run resumes where it stopped and identical
+# files are processed once.
+
+DEFAULT_FOCUS_AREAS = ["Research Question", "Key Findings"]
+
+def find_pdfs(directory: str, recursive: bool = False) -> List[str]:
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+        if not recursive:
+            break
+    return sorted(paths)
+
+def completed_hashes(output_path: str) -> Set[str]:
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run; that file is simply processed again
+                continue
+            if record.get("status") == "ok":
+                done.add(record["sha256"])
+    return done
+
+def process_batch(model, jobs: List[Dict[str, Any]], args, scheduler: RequestScheduler) -> List[Dict[str, Any]]:
+    extraction_errors = {}
+
+    def on_extracted(index, pages, error):
+        if error:
+            extraction_errors[index] = error
+
+    pdf_files = []
+    for job in jobs:
+        with open(job["path"], "rb") as f:
+            pdf_files.append(io.BytesIO(f.read()))
+    extracted = extract_pages_from_pdfs(pdf_files, max_workers=args.pdf_workers,
+                                        progress_callback=on_extracted)
+    records = []
+    papers = []
+    for index, (job, pages) in enumerate(zip(jobs, extracted)):
+        content = join_pages(pages or [])
+        record = {"file": job["path"], "sha256": job["sha256"], "name": os.path.basename(job["path"]),
+                  "pages": len(pages or []), "chars": len(content)}
+        if index in extraction_errors:
+            record.update(status="error", error=f"Text extraction failed: {extraction_errors[index]}")
+        elif not content.strip():
+            record.update(status="error", error="No text extracted; the PDF might be scanned or protected.")
+        else:
+            paper = {"id": hash_text(content), "name": record["name"], "content": content, "page_starts": page_starts(pages)}
+            record["id"] = paper["id"]
+            papers.append((record, paper))
+        records.append(record)
+
+    errors = {}
+
+    def on_analysis_done(index, analysis, error):
+        if error:
+            errors[index] = error
+
+    analyses = analyze_papers_concurrently(
+        model, [paper for _, paper in papers], args.focus_areas, args.output_format,
+        scheduler=scheduler, progress_callback=on_analysis_done,
+    )
+    analyses_by_id = {result["id"]: result["analysis"] for result in analyses}
+    # Long papers were condensed for the analysis and those chunk summaries are in the
+    # response cache, so the summaries below mostly cost one reduce call per paper. Every
+    # request goes through the shared scheduler, so its concurrency, rate limit and
+    # retries apply to chunk summaries too.
+    contents = [paper["content"] for _, paper in papers]
+    condensed = condense_papers(model, contents, scheduler)
+    summary_jobs = [i for i, (_, error) in enumerate(condensed) if error is None]
+    tasks = []
+    for i in summary_jobs:
+        prompt = build_summary_prompt(condensed[i][0], estimate_tokens(contents[i]) > SUMMARY_CHUNK_TOKENS)
+        tasks.append(lambda prompt=prompt: generate_text(model, prompt))
+    summary_results = scheduler.run(tasks)
+    summaries = [(None, error) for _, error in condensed]
+    for i, result in zip(summary_jobs, summary_results):
+        summaries[i] = result
+
+    library = get_library(args.library) if args.save_to_library else None
+    hasher = MinHasher()
+    for index, ((record, paper), (summary, summary_error)) in enumerate(zip(papers, summaries)):
+        record["analysis"] = analyses_by_id.get(paper["id"])
+        record["summary"] = summary
+        record["citations"] = extract_citations(paper["content"])
+        record["references"] = extract_references(paper["content"])
+        error = errors.get(index) or summary_error
+        if error or not record["analysis"] or not record["summary"]:
+            record.update(status="error", error=str(error) if error else "The model returned no analysis or summary.")
+        else:
+            record["status"] = "ok"
+        if library is not None:
+            library.add_paper(paper["name"], paper["content"], paper["page_starts"])
+            # Signatures let the app's duplicate check find papers ingested here
+            store_signature(library, paper["id"], paper["content"], hasher)
+            if record["analysis"]:
+                library.set_artifact(paper["id"], "analysis", f"{args.output_format}:{','.join(args.focus_areas)}", record["analysis"])
+            if record["summary"]:
+                library.set_artifact(paper["id"], "summary", "", record["summary"])
+    return records
+
+def run(args) -> int:
+    configure_api(args.api_key)
+    model = build_model(args.temperature, args.max_output_tokens)
+    scheduler = RequestScheduler(max_concurrency=args.max_concurrency, requests_per_minute=args.requests_per_minute)
+    done = completed_hashes(args.output)
+    jobs = []
+    skipped = 0
+    # Only hashes are kept up front; file bytes are read again one batch at a time
+    for path in find_pdfs(args.directory, args.recursive):
+        with open(path, "rb") as f:
+            sha256 = hash_bytes(f.read())
+        if sha256 in done:
+            skipped += 1
+            continue
+        # Identical copies within the same run are processed once
+        done.add(sha256)
+        jobs.append({"path": path, "sha256": sha256})
+    print(f"{len(jobs)} file(s) to process, {skipped} skipped as already processed or duplicate", file=sys.stderr)
+
+    failed = 0
+    start = time.perf_counter()
+    with open(args.output, "a", encoding="utf-8") as output:
+        for batch_start in range(0, len(jobs), args.batch_size):
+            batch = jobs[batch_start:batch_start + args.batch_size]
+            for record in process_batch(model, batch, args, scheduler):
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                failed += record["status"] != "ok"
+            # Flushed per batch so a crash loses at most the batch in flight
+            output.flush()
+            os.fsync(output.fileno())
+            processed = batch_start + len(batch)
+            print(f"{processed}/{len(jobs)} processed, {failed} failed, {time.perf_counter() - start:.0f}s elapsed", file=sys.stderr)
+    return 1 if failed else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze, summarize and extract citations from a folder of research papers.")
+    parser.add_argument("directory", help="Folder containing PDF files")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file results are appended to (default: results.jsonl)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Include PDFs in subfolders")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY"), help="Google API key (default: $GOOGLE_API_KEY)")
+    parser.add_argument("--focus-areas", nargs="+", default=DEFAULT_FOCUS_AREAS, help="Analysis focus areas")
+    parser.add_argument("--output-format", default="Text", choices=["Text", "Bullet Points", "Table", "JSON"])
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-output-tokens", type=int, default=1024)
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Concurrent model requests")
+    parser.add_argument("--requests-per-minute", type=float, default=60)
+    parser.add_argument("--pdf-workers", type=int, default=DEFAULT_WORKERS, help="Processes used for PDF extraction")
+    parser.add_argument("--batch-size", type=int, default=16, help="Files extracted and analyzed together before results are written")
+    parser.add_argument("--save-to-library", action="store_true", help="Also store papers, analyses and summaries in the paper library")
+    parser.add_argument("--library", default=None, help="Library database path (default: the app's library)")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or $GOOGLE_API_KEY)")
+    return args
+
+def main(argv=None) -> int:
+    return run(parse_args(argv))
+
+if __name__ == "__main__":
+    sys.exit(main())
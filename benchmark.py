@@ -0,0 +1,408 @@
+import argparse
+import atexit
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Benchmarks must neither reuse nor pollute the app's caches, so they get a scratch cache
+# directory; it has to be set before the project modules below read it at import time
+_cache_dir = tempfile.TemporaryDirectory(prefix="research_assistant_bench_")
+BENCHMARK_CACHE_DIR = _cache_dir.name
+os.environ["RESEARCH_ASSISTANT_CACHE_DIR"] = BENCHMARK_CACHE_DIR
+atexit.register(_cache_dir.cleanup)
+
+import numpy as np
+from analysis import analyze_papers_concurrently
+from cache_utils import get_cache, hash_text
+from citation import extract_citations
+from llm_client import RequestScheduler
+from pdf_utils import extract_pages_from_pdfs, join_pages, page_starts, DEFAULT_WORKERS
+from semantic_search import SearchIndex, DenseSearchIndex
+
+# Measures the hot paths with synthetic inputs and a local fake model, so runs are
+# repeatable, free and offline:
+#
+#   python benchmark.py --sizes small medium --json results.json
+#   python benchmark.py --startup
+#
+# Every case starts from cold caches. Latencies are per item (file, paper or query); for
+# the concurrent cases (extraction, analysis) an item's latency is the time since the
+# previous item finished, i.e. what each item adds to the batch.
+# peak memory is the largest Python allocation total seen by tracemalloc during the
+# case, measured in a separate run so tracing does not skew the timings.
+
+# (papers, pages per paper); a page holds roughly 3,000 characters
+CORPUS_SIZES = {
+    "small": (5, 4),
+    "medium": (20, 12),
+    "large": (60, 30),
+}
+
+QUERY_COUNT = 50
+
+VOCABULARY = (
+    "model data analysis method results network learning training performance approach "
+    "system accuracy evaluation dataset feature algorithm experiment baseline sample error "
+    "quantum protein climate market patient signal graph language image policy energy "
+    "significant robust novel efficient variance regression cluster inference bias layer"
+).split()
+SURNAMES = "Smith Johnson Lee Garcia Chen Müller Kim Nguyen Patel Brown Rossi Tanaka Silva Cohen Novak".split()
+SECTIONS = ["Abstract", "1. Introduction", "2. Related Work", "3. Methodology", "4. Results", "5. Discussion", "6. Conclusion"]
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+# Stands in for genai.GenerativeModel. Responses are derived from a hash of the prompt,
+# so identical prompts give identical text, and each call sleeps for latency seconds
+# plus up to jitter seconds (also derived from the prompt, so runs are repeatable).
+class FakeModel:
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, response_words: int = 150):
+        self.model_name = "fake-benchmark-model"
+        self._generation_config = {"temperature": 0.0}
+        self.latency = latency
+        self.jitter = jitter
+        self.response_words = response_words
+        self.calls = 0
+
+    def _respond(self, contents) -> Tuple[float, str]:
+        digest = hashlib.sha256(json.dumps(contents, sort_keys=True, default=str).encode("utf-8")).digest()
+        rng = random.Random(digest)
+        delay = self.latency + self.jitter * rng.random()
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(self.response_words))
+        return delay, text
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        self.calls += 1
+        delay, text = self._respond(contents)
+        if not stream:
+            time.sleep(delay)
+            return FakeResponse(text)
+        return self._stream(delay, text)
+
+    def _stream(self, delay: float, text: str):
+        words = text.split(" ")
+        step = max(len(words) // 8, 1)
+        time.sleep(delay / 2)
+        for i in range(0, len(words), step):
+            time.sleep(delay / 16)
+            yield FakeResponse(" ".join(words[i:i + step]) + " ")
+
+def synthetic_paper(rng: random.Random, pages: int, page_chars: int = 3000) -> List[str]:
+    # Pages of sentences with section headings, author-year and numeric citations,
+    # and a numbered references section on the last page
+    references = [(rng.choice(SURNAMES), rng.randint(1990, 2024)) for _ in range(20)]
+    page_texts = []
+    section = 0
+    for page in range(pages):
+        lines = []
+        if page * len(SECTIONS) // pages >= section and section < len(SECTIONS):
+            lines.append(SECTIONS[section])
+            section += 1
+        while sum(len(line) + 1 for line in lines) < page_chars:
+            words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 20))]
+            sentence = " ".join(words).capitalize()
+            roll = rng.random()
+            if roll < 0.2:
+                surname, year = rng.choice(references)
+                sentence += f" ({surname}, {year})"
+            elif roll < 0.3:
+                sentence += f" [{rng.randint(1, len(references))}]"
+            lines.append(sentence + ".")
+        page_texts.append("\n".join(lines))
+    page_texts[-1] += "\nReferences\n" + "\n".join(
+        f"[{i}] {surname}, {rng.choice('ABCDEFGHJK')}. ({year}). {' '.join(rng.choice(VOCABULARY) for _ in range(6)).capitalize()}. Journal of {rng.choice(VOCABULARY).capitalize()}."
+        for i, (surname, year) in enumerate(references, start=1)
+    )
+    return page_texts
+
+def _pdf_string(text: str) -> str:
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+def make_pdf(page_texts: List[str]) -> bytes:
+    # Minimal uncompressed PDF with one Helvetica text line per source line
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(page_texts)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(page_texts)} >>")
+    font = 3 + 2 * len(page_texts)
+    for i, text in enumerate(page_texts):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 {font} 0 R >> >> >>")
+        body = "BT /F1 8 Tf 10 TL 36 760 Td " + " ".join(f"{_pdf_string(line)} Tj T*" for line in text.split("\n")) + " ET"
+        objects.append(f"<< /Length {len(body.encode('latin-1'))} >>\nstream\n{body}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return out
+
+def build_corpus(size: str, seed: int = 0) -> Dict[str, Any]:
+    paper_count, pages = CORPUS_SIZES[size]
+    rng = random.Random(f"{seed}:{size}")
+    pdfs = []
+    papers = []
+    for i in range(paper_count):
+        page_texts = synthetic_paper(rng, pages)
+        pdfs.append(make_pdf(page_texts))
+        content = join_pages(page_texts)
+        papers.append({"id": hash_text(content), "name": f"paper_{i}.pdf", "content": content, "page_starts": page_starts(page_texts)})
+    queries = [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 4))) for _ in range(QUERY_COUNT)]
+    return {"size": size, "pdfs": pdfs, "papers": papers, "pages": paper_count * pages, "queries": queries}
+
+def cold_caches() -> None:
+    for name in ("pdf_text", "citations", "llm_responses"):
+        get_cache(name).clear()
+
+def percentile_ms(latencies: List[float], q: float) -> Optional[float]:
+    return float(np.percentile(latencies, q) * 1000) if latencies else None
+
+# Each case returns (items, unit, per-item latencies, seconds spent on the measured work);
+# setup such as building the index a query case searches is left out of the seconds
+def completion_intervals(start: float) -> Tuple[List[float], Callable]:
+    # A progress callback recording the time since the previous completion (or the start)
+    latencies = []
+    last = [start]
+
+    def on_done(*_):
+        now = time.perf_counter()
+        latencies.append(now - last[0])
+        last[0] = now
+    return latencies, on_done
+
+def case_pdf_extraction(corpus, args):
+    start = time.perf_counter()
+    latencies, on_done = completion_intervals(start)
+    files = [io.BytesIO(pdf) for pdf in corpus["pdfs"]]
+    extract_pages_from_pdfs(files, max_workers=args.pdf_workers, progress_callback=on_done)
+    return len(files), "files", latencies, time.perf_counter() - start
+
+def case_search_index(corpus, args):
+    index = SearchIndex()
+    latencies = []
+    start = time.perf_counter()
+    for paper in corpus["papers"]:
+        item_start = time.perf_counter()
+        index.add(paper["id"], paper["content"], paper["page_starts"])
+        latencies.append(time.perf_counter() - item_start)
+    # The matrix is assembled lazily on the first query; count it as indexing work
+    index.search(corpus["queries"][0])
+    return len(corpus["papers"]), "papers", latencies, time.perf_counter() - start
+
+def _run_queries(index, corpus):
+    index.sync(corpus["papers"])
+    index.search(corpus["queries"][0])
+    latencies = []
+    start = time.perf_counter()
+    for query in corpus["queries"]:
+        item_start = time.perf_counter()
+        index.search(query, top_k=10)
+        latencies.append(time.perf_counter() - item_start)
+    return len(latencies), "queries", latencies, time.perf_counter() - start
+
+def _query_case(index_class):
+    def case(corpus, args):
+        if index_class is DenseSearchIndex:
+            with tempfile.TemporaryDirectory() as path:
+                return _run_queries(DenseSearchIndex(path=path), corpus)
+        return _run_queries(index_class(), corpus)
+    return case
+
+def case_dense_index(corpus, args):
+    with tempfile.TemporaryDirectory() as path:
+        index = DenseSearchIndex(path=path)
+        latencies = []
+        start = time.perf_counter()
+        for paper in corpus["papers"]:
+            item_start = time.perf_counter()
+            index.add(paper["id"], paper["content"], paper["page_starts"])
+            latencies.append(time.perf_counter() - item_start)
+        return len(corpus["papers"]), "papers", latencies, time.perf_counter() - start
+
+def case_citations(corpus, args):
+    latencies = []
+    start = time.perf_counter()
+    for paper in corpus["papers"]:
+        item_start = time.perf_counter()
+        extract_citations(paper["content"])
+        latencies.append(time.perf_counter() - item_start)
+    return len(latencies), "papers", latencies, time.perf_counter() - start
+
+def case_analysis(corpus, args):
+    model = FakeModel(latency=args.latency, jitter=args.jitter)
+    scheduler = RequestScheduler(max_concurrency=args.max_concurrency, requests_per_minute=1e6)
+    start = time.perf_counter()
+    latencies, on_done = completion_intervals(start)
+    analyze_papers_concurrently(model, corpus["papers"], ["Research Question", "Key Findings"], "Text",
+                                scheduler=scheduler, progress_callback=on_done)
+    return len(corpus["papers"]), "papers", latencies, time.perf_counter() - start
+
+# PDF extraction runs in worker processes that tracemalloc cannot see (and that inherit
+# its overhead when forked), so no peak memory is reported for it
+UNTRACED_CASES = {"pdf_extraction"}
+
+CASES: Dict[str, Callable] = {
+    "pdf_extraction": case_pdf_extraction,
+    "search_index": case_search_index,
+    "search_query": _query_case(SearchIndex),
+    "dense_index": case_dense_index,
+    "dense_query": _query_case(DenseSearchIndex),
+    "citations": case_citations,
+    "analysis": case_analysis,
+}
+
+def run_case(name: str, corpus: Dict[str, Any], args) -> Dict[str, Any]:
+    case = CASES[name]
+    cold_caches()
+    items, unit, latencies, elapsed = case(corpus, args)
+    peak = None
+    if not args.skip_memory and name not in UNTRACED_CASES:
+        cold_caches()
+        tracemalloc.start()
+        case(corpus, args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "case": name,
+        "size": corpus["size"],
+        "items": items,
+        "unit": unit,
+        "seconds": elapsed,
+        "throughput": items / elapsed if elapsed else None,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "peak_mb": peak / 2 ** 20 if peak is not None else None,
+    }
+
+def format_row(result: Dict[str, Any]) -> str:
+    def number(value, spec):
+        width = int(spec.split(".")[0])
+        return format(value, spec) if value is not None else "-".rjust(width)
+    return (f"{result['case']:<16}{result['size']:<8}{result['items']:>7} {result['unit']:<8}"
+            f"{number(result['seconds'], '9.3f')}{number(result['throughput'], '12.1f')}/s"
+            f"{number(result['p50_ms'], '11.2f')}{number(result['p95_ms'], '11.2f')}{number(result['peak_mb'], '10.1f')}")
+
+# What app.py imports before the first paint
+STARTUP_IMPORTS = "import streamlit, google.api_core.exceptions, ui_layout, llm_client"
+
+# Heavy dependencies are deferred until a feature needs them; each snippet triggers that first use
+FIRST_USE = {
+    "model": "from llm_client import build_model; build_model()",
+    "pdf_extraction": "from pdf_utils import _page_ranges; _page_ranges(PDF)",
+    "semantic_search": "from semantic_search import SearchIndex; index = SearchIndex(); index.add('a', 'sample text'); index.search('sample')",
+    "related_papers": "from citation_graph import CitationIndex; CitationIndex().matrix",
+}
+
+def import_times(code: str) -> Tuple[List[Dict[str, Any]], str]:
+    # Runs code in a fresh interpreter under -X importtime, so every import is cold
+    completed = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if completed.returncode:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return modules, completed.stdout
+
+def measure_startup(min_ms: float) -> Dict[str, Any]:
+    modules, _ = import_times(STARTUP_IMPORTS)
+    loaded_at_startup = {module["module"] for module in modules}
+    first_use = []
+    pdf = make_pdf(["sample text"])
+    for feature, snippet in FIRST_USE.items():
+        code = f"{STARTUP_IMPORTS}\nimport time\nPDF = {pdf!r}\nstart = time.perf_counter()\n{snippet}\nprint(time.perf_counter() - start)"
+        feature_modules, stdout = import_times(code)
+        # Packages like scipy load submodules lazily, and each shows up as a separate
+        # top-level import; those are added to the package imported first
+        deferred = {}
+        for module in feature_modules:
+            if module["depth"] == 0 and module["module"] not in loaded_at_startup:
+                name = module["module"]
+                package = next((package for package in deferred if name.startswith(package + ".")), name)
+                deferred[package] = deferred.get(package, 0) + module["cumulative_ms"]
+        first_use.append({
+            "feature": feature,
+            "ms": float(stdout.split()[-1]) * 1000,
+            "imports": [{"module": package, "cumulative_ms": ms}
+                        for package, ms in sorted(deferred.items(), key=lambda item: -item[1])[:3]],
+        })
+    return {
+        "startup_ms": sum(module["cumulative_ms"] for module in modules if module["depth"] == 0),
+        "startup": [module for module in modules if module["depth"] <= 1 and module["cumulative_ms"] >= min_ms],
+        "first_use": first_use,
+    }
+
+def print_startup(report: Dict[str, Any]) -> None:
+    print(f"{'startup import':<40}{'cumulative ms':>14}")
+    for module in report["startup"]:
+        print(f"{'  ' * module['depth'] + module['module']:<40}{module['cumulative_ms']:>14.1f}")
+    print(f"{'total':<40}{report['startup_ms']:>14.1f}\n")
+    print(f"{'first use':<18}{'ms':>9}   heaviest deferred imports")
+    for feature in report["first_use"]:
+        imports = ", ".join(f"{module['module']} ({module['cumulative_ms']:.0f} ms)" for module in feature["imports"])
+        print(f"{feature['feature']:<18}{feature['ms']:>9.1f}   {imports or '-'}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction, search, citation parsing and analysis on synthetic papers.")
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=list(CORPUS_SIZES))
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model latency per call in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Extra random latency per call, up to this many seconds")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Concurrent fake model requests")
+    parser.add_argument("--pdf-workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-memory", action="store_true", help="Skip the traced run that measures peak memory")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--startup", action="store_true",
+                        help="Report the import cost of each module at app start and of features loaded on first use, instead of running the cases")
+    parser.add_argument("--min-ms", type=float, default=10, help="Hide startup imports cheaper than this (with --startup)")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.startup:
+        report = measure_startup(args.min_ms)
+        print_startup(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return 0
+    results = []
+    print(f"{'case':<16}{'size':<8}{'items':>16}{'seconds':>9}{'throughput':>14}{'p50 ms':>11}{'p95 ms':>11}{'peak MB':>10}")
+    for size in args.sizes:
+        corpus = build_corpus(size, args.seed)
+        for name in args.cases:
+            result = run_case(name, corpus, args)
+            results.append(result)
+            print(format_row(result), flush=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,318 @@
-from typing import List
+from typing import List, Dict, Any, Optional, Tuple
+from functools import lru_cache
+import json
 import re
+from cache_utils import get_cache, hash_text
+from metrics import timed
 
+# Bump whenever the parsing rules change so cached results are recomputed
+CITATION_PARSER_VERSION = 1
+
+YEAR = r"(?:1[5-9]|20)\d{2}[a-z]?"
+SURNAME = r"(?:(?:van|von|de|der|del|da|di|le|la)\s+)*[A-Z][A-Za-z'À-ſ\-]+"
+
+# One alternation scanned once over the body: parenthetical author-year groups,
+# narrative "Smith et al. (2020)" citations and numeric [12] / [3, 5-7] citations
+CITATION_PATTERN = re.compile(
+    rf"(?P<narrative>(?P<narrative_authors>{SURNAME}(?:\s+et\s+al\.?|\s+(?:and|&)\s+{SURNAME})?)"
+    rf"\s+\((?P<narrative_year>{YEAR})(?:,\s*(?P<narrative_page>(?:pp?\.|pages?)\s*\d+(?:\s*[-–]\s*\d+)?))?\))"
+    rf"|(?P<paren>\((?=[^()]*\b{YEAR}\b)[^()]{{1,300}}\))"
+    r"|(?P<numeric>\[(?P<numbers>\d{1,3}(?:\s*[,\-–]\s*\d{1,3})*)\])"
+)
+
+# One author-year entry inside a parenthetical group, e.g. "see Smith & Jones, 2019, p. 4"
+PAREN_ENTRY = re.compile(
+    rf"^\s*(?:(?:see(?:\s+also)?|e\.g\.,?|i\.e\.,?|cf\.)\s+)?(?P<authors>{SURNAME}(?:(?:,\s*|\s+(?:and|&)\s+|,\s*(?:and|&)\s+){SURNAME})*(?:\s+et\s+al\.?)?)"
+    rf",?\s+(?P<year>{YEAR})(?:,\s*(?P<page>(?:pp?\.|pages?)\s*\d+(?:\s*[-–]\s*\d+)?))?\s*$"
+)
+
+AUTHOR_SEPARATOR = re.compile(r",\s*(?:and|&)\s+|\s+(?:and|&)\s+|,\s*")
+ET_AL = re.compile(r"\s+et\s+al\.?$")
+PAGE_NUMBER = re.compile(r"\d+(?:\s*[-–]\s*\d+)?")
+
+REFERENCES_HEADING = re.compile(
+    r"^[ \t]*(?:\d+\.?[ \t]+)?(?:references|bibliography|works cited|literature cited)[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+NUMBERED_REFERENCE = re.compile(r"^[ \t]*(?:\[(\d{1,3})\]|(\d{1,3})\.)[ \t]+", re.MULTILINE)
+REFERENCE_START = re.compile(rf"^[ \t]*{SURNAME},\s+[A-Z]", re.MULTILINE)
+REFERENCE_YEAR = re.compile(rf"\b({YEAR})\b")
+
+def _parse_authors(authors: str) -> Dict[str, Any]:
+    et_al = bool(ET_AL.search(authors))
+    names = [name.strip() for name in AUTHOR_SEPARATOR.split(ET_AL.sub("", authors)) if name.strip()]
+    return {"authors": names, "et_al": et_al}
+
+def _parse_page(page: Optional[str]) -> Optional[str]:
+    if not page:
+        return None
+    match = PAGE_NUMBER.search(page)
+    return match.group(0).replace(" ", "") if match else None
+
+def _expand_numbers(numbers: str) -> List[int]:
+    expanded = []
+    for part in numbers.split(","):
+        bounds = [int(n) for n in re.split(r"\s*[-–]\s*", part.strip()) if n]
+        if len(bounds) == 2 and 0 < bounds[1] - bounds[0] < 50:
+            expanded.extend(range(bounds[0], bounds[1] + 1))
+        else:
+            expanded.extend(bounds)
+    return expanded
+
+def find_references_section(text: str) -> int:
+    # Offset of the last References/Bibliography heading, or -1 if the paper has none
+    matches = list(REFERENCES_HEADING.finditer(text))
+    return matches[-1].end() if matches else -1
+
+def extract_references(text: str, start: Optional[int] = None) -> List[Dict[str, Any]]:
+    # start is the offset from find_references_section, for callers that already looked it up
+    if start is None:
+        start = find_references_section(text)
+    if start == -1:
+        return []
+    section = text[start:]
+    numbered = list(NUMBERED_REFERENCE.finditer(section))
+    boundaries = numbered if numbered else list(REFERENCE_START.finditer(section))
+    references = []
+    for i, match in enumerate(boundaries):
+        end = boundaries[i + 1].start() if i + 1 < len(boundaries) else len(section)
+        raw = " ".join(section[match.start():end].split())
+        if not raw:
+            continue
+        number = match.group(1) or match.group(2) if numbered else None
+        year = REFERENCE_YEAR.search(raw)
+        references.append({
+            "number": int(number) if number else None,
+            "raw": raw,
+            "year": year.group(1) if year else None,
+        })
+    return references
+
+def _scan_citations(text: str) -> List[Dict[str, Any]]:
+    references_start = find_references_section(text)
+    body = text if references_start == -1 else text[:references_start]
+    references = {ref["number"]: ref["raw"] for ref in extract_references(text, references_start) if ref["number"] is not None}
+
+    citations: Dict[tuple, Dict[str, Any]] = {}
+
+    def add(key: tuple, record: Dict[str, Any]) -> None:
+        # Repeated citations of the same work are merged and counted
+        if key in citations:
+            citations[key]["count"] += 1
+        else:
+            record["count"] = 1
+            citations[key] = record
+
+    for match in CITATION_PATTERN.finditer(body):
+        if match.group("narrative"):
+            parsed = _parse_authors(match.group("narrative_authors"))
+            page = _parse_page(match.group("narrative_page"))
+            year = match.group("narrative_year")
+            add(("author_year", parsed["authors"][0].lower(), year, page),
+                {"type": "author_year", "raw": match.group(0), "year": year, "page": page, **parsed})
+        elif match.group("paren"):
+            for entry in match.group("paren")[1:-1].split(";"):
+                entry_match = PAREN_ENTRY.match(entry)
+                if not entry_match:
+                    continue
+                parsed = _parse_authors(entry_match.group("authors"))
+                page = _parse_page(entry_match.group("page"))
+                year = entry_match.group("year")
+                add(("author_year", parsed["authors"][0].lower(), year, page),
+                    {"type": "author_year", "raw": f"({entry.strip()})", "year": year, "page": page, **parsed})
+        else:
+            for number in _expand_numbers(match.group("numbers")):
+                add(("numeric", number),
+                    {"type": "numeric", "raw": f"[{number}]", "number": number, "reference": references.get(number)})
+    return list(citations.values())
+
+@timed("citation_extraction")
 def extract_citations(text: str) -> List[dict]:
-    # Simple regex-based citation extraction
-    citations = re.findall(r'\((?:[^()]*\d{4}[^()]*)\)', text)
-    
-    # Convert extracted citations to a list of dictionaries
-    return [{"raw": citation} for citation in citations]
+    # Results are cached per content hash, so each paper is scanned once across reruns and sessions
+    cache = get_cache("citations")
+    cache_key = f"v{CITATION_PARSER_VERSION}:{hash_text(text)}"
+    citations = cache.get(cache_key)
+    if citations is None:
+        citations = _scan_citations(text)
+        cache.set(cache_key, citations)
+    return citations
+
+# Reference list entries in the two layouts PDFs most often use:
+# APA-like "Smith, J., & Lee, M. (2019). Title. Venue." and IEEE-like "J. Smith and M. Lee, "Title," Venue, 2019."
+REFERENCE_PREFIX = r"^(?:\[\d{1,3}\]|\d{1,3}\.)?\s*"
+APA_REFERENCE = re.compile(
+    REFERENCE_PREFIX + rf"(?P<authors>.+?)\s*\((?P<year>{YEAR})\)\.\s*(?P<title>.+?[.?!])\s+(?P<venue>.*?)\.?$"
+)
+IEEE_REFERENCE = re.compile(
+    REFERENCE_PREFIX + rf"(?P<authors>.+?),\s*[\"“](?P<title>.+?)[,.]?[\"”]\s*,?\s*(?P<venue>.*?),?\s*(?P<year>{YEAR})\b.*$"
+)
+SURNAME_FIRST = re.compile(rf"({SURNAME}),\s*((?:[A-Z]\.\s*-?\s*)+)")
+INITIALS_FIRST = re.compile(rf"((?:[A-Z]\.\s*-?\s*)+)\s*({SURNAME})")
+
+# Per-style rules for rendering a record; adding a style means adding a row here
+CITATION_STYLES = {
+    "apa": {
+        "in_text": "({authors}, {year}{page})", "in_text_page": ", p. {page}", "in_text_pages": ", pp. {page}",
+        "in_text_two": "{0} & {1}", "in_text_max": 2,
+        "reference": "{authors} ({year}). {title}. {venue}.",
+        "name_first": "{surname}, {initials}", "name_other": "{surname}, {initials}",
+        "ref_two": "{0}, & {1}", "ref_joiner": ", ", "ref_last": ", & {0}", "ref_max": 20,
+    },
+    "mla": {
+        "in_text": "({authors}{page})", "in_text_page": " {page}", "in_text_pages": " {page}",
+        "in_text_two": "{0} and {1}", "in_text_max": 2,
+        "reference": "{authors}. \"{title}.\" {venue}, {year}.",
+        "name_first": "{surname}, {initials}", "name_other": "{initials} {surname}",
+        "ref_two": "{0}, and {1}", "ref_joiner": ", ", "ref_last": ", and {0}", "ref_max": 2,
+    },
+    "chicago": {
+        "in_text": "({authors} {year}{page})", "in_text_page": ", {page}", "in_text_pages": ", {page}",
+        "in_text_two": "{0} and {1}", "in_text_max": 3,
+        "reference": "{authors}. {year}. \"{title}.\" {venue}.",
+        "name_first": "{surname}, {initials}", "name_other": "{initials} {surname}",
+        "ref_two": "{0}, and {1}", "ref_joiner": ", ", "ref_last": ", and {0}", "ref_max": 10,
+    },
+}
+
+def _parse_names(authors: str, surname_first: bool) -> List[Tuple[str, str]]:
+    if surname_first:
+        return [(surname, " ".join(initials.split())) for surname, initials in SURNAME_FIRST.findall(authors)]
+    return [(surname, " ".join(initials.split())) for initials, surname in INITIALS_FIRST.findall(authors)]
+
+def parse_reference(raw: str) -> Optional[Dict[str, Any]]:
+    for pattern, surname_first in ((APA_REFERENCE, True), (IEEE_REFERENCE, False)):
+        match = pattern.match(raw)
+        if match:
+            names = _parse_names(match.group("authors"), surname_first)
+            if names:
+                return {
+                    "names": names,
+                    "year": match.group("year"),
+                    "title": match.group("title").strip(" .,"),
+                    "venue": match.group("venue").strip(" .,"),
+                }
+    return None
+
+def to_bibliographic(record: Dict[str, Any]) -> Dict[str, Any]:
+    # Normalizes an in-text citation, numeric citation or reference entry into one shape
+    parsed = parse_reference(record.get("reference") or record.get("raw", "")) if record.get("type") != "author_year" else None
+    if parsed:
+        return dict(parsed, page=record.get("page"))
+    names = [(name, "") for name in record.get("authors", [])]
+    return {"names": names, "et_al": record.get("et_al", False), "year": record.get("year"),
+            "title": None, "venue": None, "page": record.get("page")}
+
+def _in_text_authors(names: List[Tuple[str, str]], et_al: bool, rules: Dict[str, Any]) -> str:
+    surnames = [surname for surname, _ in names]
+    if et_al or len(surnames) > rules["in_text_max"]:
+        return f"{surnames[0]} et al."
+    if len(surnames) == 2:
+        return rules["in_text_two"].format(*surnames)
+    if len(surnames) == 3:
+        return f"{surnames[0]}, {surnames[1]}, and {surnames[2]}"
+    return surnames[0]
+
+def _reference_authors(names: List[Tuple[str, str]], rules: Dict[str, Any]) -> str:
+    rendered = [rules["name_first"].format(surname=names[0][0], initials=names[0][1]).strip(", ")]
+    rendered += [rules["name_other"].format(surname=s, initials=i).strip(", ") for s, i in names[1:]]
+    if len(rendered) > rules["ref_max"]:
+        return f"{rendered[0]}, et al."
+    if len(rendered) == 2:
+        return rules["ref_two"].format(*rendered)
+    if len(rendered) > 2:
+        return rules["ref_joiner"].join(rendered[:-1]) + rules["ref_last"].format(rendered[-1])
+    return rendered[0]
+
+@lru_cache(maxsize=65536)
+def _format_record(record_json: str, style: str) -> str:
+    record = json.loads(record_json)
+    rules = CITATION_STYLES[style]
+    entry = to_bibliographic(record)
+    if not entry["names"]:
+        return record.get("reference") or record.get("raw", "")
+    if entry["title"]:
+        # A full reference entry was recovered, so render it as a reference list item
+        rendered = rules["reference"].format(authors=_reference_authors(entry["names"], rules), **entry)
+        return re.sub(r"(?<!\.)\.\.(?!\.)", ".", rendered)
+    page = ""
+    if entry["page"]:
+        page_rule = rules["in_text_pages"] if "-" in entry["page"] or "–" in entry["page"] else rules["in_text_page"]
+        page = page_rule.format(page=entry["page"])
+    authors = _in_text_authors(entry["names"], entry.get("et_al", False), rules)
+    return rules["in_text"].format(authors=authors, year=entry["year"] or "n.d.", page=page)
+
+def format_citations(citations: List[dict], style: str = 'apa') -> List[str]:
+    # Formats a whole list in one pass; each (record, style) pair is rendered only once per process
+    style = style.lower()
+    if style not in CITATION_STYLES:
+        return [format_citation(citation, style) for citation in citations]
+    return [_format_record(json.dumps(citation, sort_keys=True), style) for citation in citations]
+
+def _bibtex_key(entry: Dict[str, Any], used: Dict[str, int]) -> str:
+    base = re.sub(r"[^A-Za-z0-9]", "", entry["names"][0][0] if entry["names"] else "anon") + (entry["year"] or "")
+    used[base] = used.get(base, 0) + 1
+    return base if used[base] == 1 else f"{base}{chr(ord('a') + used[base] - 2)}"
+
+def _unparsed_text(citation: dict, entry: Dict[str, Any]) -> Optional[str]:
+    # Raw text of a record whose authors and title could not be parsed, without its list
+    # marker, so the export keeps what the paper said instead of an empty entry
+    if entry["names"] or entry.get("title"):
+        return None
+    raw = re.sub(REFERENCE_PREFIX, "", citation.get("reference") or citation.get("raw", "")).strip()
+    return raw or None
+
+def export_bibtex(citations: List[dict]) -> str:
+    lines = []
+    used: Dict[str, int] = {}
+    for citation in citations:
+        entry = to_bibliographic(citation)
+        note = _unparsed_text(citation, entry)
+        if not entry["names"] and not entry.get("title") and not note:
+            continue
+        fields = [("author", " and ".join(f"{s}, {i}".strip(", ") for s, i in entry["names"]))]
+        fields += [(name, entry[name]) for name in ("title", "year") if entry.get(name)]
+        if note:
+            fields.append(("note", note))
+        if entry.get("venue"):
+            fields.append(("journal", entry["venue"]))
+        if entry.get("page"):
+            fields.append(("pages", entry["page"].replace("-", "--")))
+        lines.append(f"@{'article' if entry.get('venue') else 'misc'}{{{_bibtex_key(entry, used)},")
+        lines.extend(f"  {name} = {{{value}}}," for name, value in fields if value)
+        lines.append("}")
+        lines.append("")
+    return "\n".join(lines)
+
+def export_ris(citations: List[dict]) -> str:
+    lines = []
+    for citation in citations:
+        entry = to_bibliographic(citation)
+        note = _unparsed_text(citation, entry)
+        if not entry["names"] and not entry.get("title") and not note:
+            continue
+        lines.append(f"TY  - {'JOUR' if entry.get('venue') else 'GEN'}")
+        lines.extend(f"AU  - {s}, {i}".rstrip(", ") for s, i in entry["names"])
+        if entry.get("year"):
+            lines.append(f"PY  - {entry['year']}")
+        if entry.get("title"):
+            lines.append(f"TI  - {entry['title']}")
+        if entry.get("venue"):
+            lines.append(f"JO  - {entry['venue']}")
+        if entry.get("page"):
+            start, _, end = entry["page"].replace("–", "-").partition("-")
+            lines.append(f"SP  - {start}")
+            if end:
+                lines.append(f"EP  - {end}")
+        if note:
+            lines.append(f"N1  - {note}")
+        lines.append("ER  - ")
+        lines.append("")
+    return "\n".join(lines)
 
 def format_citation(citation: dict, style: str = 'apa') -> str:
     raw_citation = citation.get("raw", "")
     
-    if style.lower() == 'apa':
-        return f"APA Style: {raw_citation}"
-    elif style.lower() == 'mla':
-        return f"MLA Style: {raw_citation}"
-    elif style.lower() == 'chicago':
-        return f"Chicago Style: {raw_citation}"
+    if style.lower() in CITATION_STYLES:
+        return format_citations([citation], style)[0]
     else:
         return f"Unknown Style: {raw_citation}"
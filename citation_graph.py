@@ -0,0 +1,121 @@
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
+import numpy as np
+import re
+import unicodedata
+from citation import extract_citations, extract_references, to_bibliographic
+
+if TYPE_CHECKING:
+    from scipy import sparse
+
+def canonical_key(record: Dict[str, Any]) -> Optional[str]:
+    # "surname:year" with accents, case and year suffixes dropped, so "(Müller, 2020a)" in one
+    # paper and "Muller, K. (2020). ..." in another's reference list map to the same work
+    entry = to_bibliographic(record)
+    if not entry["names"] or not entry["year"]:
+        return None
+    surname = unicodedata.normalize("NFKD", entry["names"][0][0]).encode("ascii", "ignore").decode()
+    surname = re.sub(r"[^a-z]", "", surname.lower())
+    return f"{surname}:{entry['year'][:4]}" if surname else None
+
+def paper_work_keys(text: str) -> Dict[str, str]:
+    # Canonical key -> display label for every work a paper cites, from in-text citations and its reference list
+    works = {}
+    for record in extract_references(text) + extract_citations(text):
+        key = canonical_key(record)
+        if key and key not in works:
+            works[key] = record.get("reference") or record["raw"]
+    return works
+
+# Papers x cited-works incidence matrix over the loaded library. Co-citation counts
+# (works cited together) come from A^T A and bibliographic coupling (papers citing the
+# same works) from A A^T; both are single sparse products, rebuilt only after changes.
+class CitationIndex:
+    def __init__(self):
+        self.paper_ids: List[str] = []
+        self.work_keys: List[str] = []
+        self.work_labels: Dict[str, str] = {}
+        self._paper_works: Dict[str, List[str]] = {}
+        self._matrix = None
+        self._work_positions: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.paper_ids)
+
+    def add(self, paper_id: str, text: str) -> None:
+        works = paper_work_keys(text)
+        for key, label in works.items():
+            self.work_labels.setdefault(key, label)
+        if paper_id not in self._paper_works:
+            self.paper_ids.append(paper_id)
+        self._paper_works[paper_id] = list(works)
+        self._matrix = None
+
+    def remove(self, paper_id: str) -> None:
+        if self._paper_works.pop(paper_id, None) is not None:
+            self.paper_ids.remove(paper_id)
+            self._matrix = None
+
+    def sync(self, papers: List[Dict[str, Any]]) -> None:
+        wanted = {paper["id"]: paper for paper in papers}
+        for paper_id in [paper_id for paper_id in self.paper_ids if paper_id not in wanted]:
+            self.remove(paper_id)
+        for paper_id, paper in wanted.items():
+            if paper_id not in self._paper_works:
+                self.add(paper_id, paper["content"])
+
+    @property
+    def matrix(self) -> "sparse.csr_matrix":
+        if self._matrix is None:
+            # scipy is imported here so the app does not pay for it at startup
+            from scipy import sparse
+            self.work_keys = sorted({key for works in self._paper_works.values() for key in works})
+            self._work_positions = {key: i for i, key in enumerate(self.work_keys)}
+            rows = [i for i, paper_id in enumerate(self.paper_ids) for _ in self._paper_works[paper_id]]
+            cols = [self._work_positions[key] for paper_id in self.paper_ids for key in self._paper_works[paper_id]]
+            self._matrix = sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                shape=(len(self.paper_ids), len(self.work_keys)),
+            )
+        return self._matrix
+
+    def _ranked(self, scores: np.ndarray, labels: List[str], exclude: int, top_k: int) -> List[tuple]:
+        scores = scores.copy()
+        if exclude >= 0:
+            scores[exclude] = 0
+        candidates = np.flatnonzero(scores > 0)
+        order = candidates[np.argsort(-scores[candidates], kind="stable")][:top_k]
+        return [(labels[i], float(scores[i])) for i in order]
+
+    def bibliographic_coupling(self, paper_id: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        # Other papers in the library ranked by how many cited works they share with paper_id
+        if paper_id not in self._paper_works:
+            return []
+        matrix = self.matrix
+        row = self.paper_ids.index(paper_id)
+        shared = np.asarray((matrix @ matrix[row].T).todense()).ravel()
+        return [{"paper_id": pid, "shared_references": int(score)}
+                for pid, score in self._ranked(shared, self.paper_ids, row, top_k)]
+
+    def co_cited(self, work_key: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        # Works most often cited by the same papers that cite work_key
+        matrix = self.matrix
+        if work_key not in self._work_positions:
+            return []
+        column = self._work_positions[work_key]
+        citing = matrix[:, column].T
+        counts = np.asarray((citing @ matrix).todense()).ravel()
+        return [{"work": key, "label": self.work_labels.get(key, key), "co_citations": int(score)}
+                for key, score in self._ranked(counts, self.work_keys, column, top_k)]
+
+    def most_cited(self, paper_ids: Optional[List[str]] = None, top_k: int = 10,
+                   min_cited_by: int = 2) -> List[Dict[str, Any]]:
+        # Works cited by the most papers among paper_ids (default: the whole library). A work
+        # cited by fewer than min_cited_by papers says nothing about the set, so it is left out
+        matrix = self.matrix
+        if paper_ids is not None:
+            rows = [self.paper_ids.index(pid) for pid in paper_ids if pid in self._paper_works]
+            matrix = matrix[rows]
+        counts = np.asarray(matrix.sum(axis=0)).ravel()
+        counts[counts < min_cited_by] = 0
+        return [{"work": key, "label": self.work_labels.get(key, key), "cited_by": int(score)}
+                for key, score in self._ranked(counts, self.work_keys, -1, top_k)]
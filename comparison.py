@@ -0,0 +1,213 @@
+import json
+from typing import Any, Dict, List, Optional
+import numpy as np
+from cache_utils import hash_text
+from llm_client import RequestScheduler, generate_text, model_fingerprint
+from metrics import metrics, timed
+
+# Papers join the group whose members they are, on average, at least this similar to
+# (TF-IDF cosine between whole papers); otherwise they start a group of their own
+CLUSTER_THRESHOLD = 0.2
+# Groups are capped so each comparison prompt stays a manageable size
+MAX_CLUSTER_SIZE = 6
+# Characters of each paper's analysis included in a comparison prompt
+ANALYSIS_CHARS = 3000
+
+GROUP_PROMPT = """Compare the following research papers, which cover related topics, using their analyses below.
+Respond with JSON only, in this form:
+{"theme": "one sentence on what the papers have in common", "similarities": ["..."], "differences": ["..."], "future_research": ["..."]}"""
+
+SYNTHESIS_PROMPT = """The research papers below were split into groups by topic, and each group was compared separately. Compare the groups with each other.
+Respond with JSON only, in this form:
+{"overview": "a short paragraph about the whole set of papers", "differences": ["how the groups differ"], "future_research": ["..."]}"""
+
+def parse_json_response(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    # Models tend to wrap JSON in a code fence or a sentence, so only the outermost object is parsed
+    if not text:
+        return None
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        value = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+def _items(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return []
+
+def _bullets(items: List[str]) -> str:
+    return "\n".join(f"- {item}" for item in items)
+
+# Compares papers group by group instead of in one prompt. Papers are grouped by the
+# similarity of their text, each group of two or more is compared in its own request,
+# and one more request compares the groups with each other. Groups are kept between
+# updates: a new paper joins the closest group with room, so adding one paper to a large
+# set re-asks the model about that group and the cross-group synthesis only. Results are
+# memoized by the model and the papers and analyses they were built from, and prompts are
+# deterministic, so the response cache also answers them after a restart. A comparison
+# that failed is kept, errors included, until retry_failed is called, so a rerun of the
+# page does not send the failing requests again.
+class ComparisonEngine:
+    def __init__(self, threshold: float = CLUSTER_THRESHOLD, max_cluster_size: int = MAX_CLUSTER_SIZE):
+        self.threshold = threshold
+        self.max_cluster_size = max_cluster_size
+        self.clusters: List[List[str]] = []
+        self._groups: Dict[str, Dict[str, Any]] = {}
+        self._syntheses: Dict[str, Dict[str, Any]] = {}
+        self._last: Optional[tuple] = None
+
+    def retry_failed(self) -> None:
+        # Lets the next compare call ask again about groups whose requests failed
+        if self._last and self._last[1]["errors"]:
+            self._last = None
+
+    def update_clusters(self, doc_ids: List[str], similarity: np.ndarray) -> List[List[str]]:
+        # similarity rows and columns follow doc_ids. Papers that are gone leave their
+        # group; papers not yet grouped are placed in input order.
+        positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        clusters = [[doc_id for doc_id in cluster if doc_id in positions] for cluster in self.clusters]
+        clusters = [cluster for cluster in clusters if cluster]
+        placed = {doc_id for cluster in clusters for doc_id in cluster}
+        for doc_id in doc_ids:
+            if doc_id in placed:
+                continue
+            row = similarity[positions[doc_id]]
+            best, best_score = None, self.threshold
+            for cluster in clusters:
+                if len(cluster) >= self.max_cluster_size:
+                    continue
+                score = float(np.mean([row[positions[other]] for other in cluster]))
+                if score >= best_score:
+                    best, best_score = cluster, score
+            if best is None:
+                clusters.append([doc_id])
+            else:
+                best.append(doc_id)
+            placed.add(doc_id)
+        self.clusters = clusters
+        return clusters
+
+    @staticmethod
+    def _group_prompt(papers: List[Dict[str, Any]]) -> str:
+        blocks = [f"Paper: {paper['name']}\nAnalysis: {paper['analysis'][:ANALYSIS_CHARS]}" for paper in papers]
+        return GROUP_PROMPT + "\n\n" + "\n\n".join(blocks)
+
+    @staticmethod
+    def _synthesis_prompt(groups: List[Dict[str, Any]]) -> str:
+        blocks = []
+        for number, group in enumerate(groups, start=1):
+            if group["theme"]:
+                summary = f"Theme: {group['theme']}\nShared points:\n{_bullets(group['similarities'])}"
+            else:
+                # A paper without a group is described by the start of its own analysis
+                summary = f"Analysis: {group['analysis'][:ANALYSIS_CHARS // 3]}"
+            blocks.append(f"Group {number}: {', '.join(group['papers'])}\n{summary}")
+        return SYNTHESIS_PROMPT + "\n\n" + "\n\n".join(blocks)
+
+    @timed("comparison")
+    def compare(self, model, analysis_results: List[Dict[str, Any]], similarity: np.ndarray,
+                scheduler: Optional[RequestScheduler] = None) -> Dict[str, Any]:
+        # analysis_results need id, name and analysis; similarity follows their order
+        fingerprint = model_fingerprint(model)
+        key = hash_text(json.dumps([fingerprint, [[r['id'], hash_text(r['analysis'])] for r in analysis_results]],
+                                   sort_keys=True))
+        if self._last and self._last[0] == key:
+            return dict(self._last[1], requests=0)
+        by_id = {result['id']: result for result in analysis_results}
+        clusters = self.update_clusters([result['id'] for result in analysis_results], similarity)
+        # Members are sorted so the same group always produces the same prompt
+        clusters = [sorted(cluster, key=lambda doc_id: (by_id[doc_id]['name'], doc_id)) for cluster in clusters]
+        group_keys = [hash_text(json.dumps([fingerprint, [[doc_id, hash_text(by_id[doc_id]['analysis'])] for doc_id in cluster]],
+                                           sort_keys=True))
+                      for cluster in clusters]
+        # Results for groups that no longer exist are dropped so the memo stays the size of the current set
+        self._groups = {group_key: parsed for group_key, parsed in self._groups.items() if group_key in group_keys}
+        pending = [(group_key, cluster) for group_key, cluster in zip(group_keys, clusters)
+                   if len(cluster) > 1 and group_key not in self._groups]
+        errors = []
+        requests = 0
+        if pending:
+            scheduler = scheduler or RequestScheduler()
+            prompts = [self._group_prompt([by_id[doc_id] for doc_id in cluster]) for _, cluster in pending]
+            outputs = scheduler.run([lambda prompt=prompt: generate_text(model, prompt) for prompt in prompts])
+            requests += len(prompts)
+            for (group_key, cluster), (text, error) in zip(pending, outputs):
+                if error or not text:
+                    # Not memoized, so the comparison after retry_failed asks about this group again
+                    errors.append(f"Comparing {', '.join(by_id[d]['name'] for d in cluster)} failed: {error or 'empty response'}")
+                    continue
+                parsed = parse_json_response(text)
+                if parsed is None:
+                    parsed = {"theme": "", "similarities": [text.strip()]}
+                self._groups[group_key] = parsed
+
+        groups = []
+        for group_key, cluster in zip(group_keys, clusters):
+            parsed = self._groups.get(group_key, {}) if len(cluster) > 1 else {}
+            groups.append({
+                "paper_ids": cluster,
+                "papers": [by_id[doc_id]['name'] for doc_id in cluster],
+                "theme": str(parsed.get("theme") or ""),
+                "similarities": _items(parsed.get("similarities")),
+                "differences": _items(parsed.get("differences")),
+                "future_research": _items(parsed.get("future_research")),
+                "analysis": by_id[cluster[0]]['analysis'],
+            })
+
+        synthesis = {}
+        synthesis_key = None
+        if len(groups) > 1:
+            prompt = self._synthesis_prompt(groups)
+            synthesis_key = hash_text(json.dumps([fingerprint, prompt], sort_keys=True))
+        self._syntheses = {k: v for k, v in self._syntheses.items() if k == synthesis_key}
+        if synthesis_key:
+            if synthesis_key not in self._syntheses:
+                requests += 1
+                scheduler = scheduler or RequestScheduler()
+                text, error = scheduler.run([lambda: generate_text(model, prompt)])[0]
+                if error or not text:
+                    errors.append(f"Comparing the groups failed: {error or 'empty response'}")
+                else:
+                    self._syntheses[synthesis_key] = parse_json_response(text) or {"overview": text.strip()}
+            synthesis = self._syntheses.get(synthesis_key, {})
+        metrics.increment("comparison_requests_total", requests)
+
+        result = merge_comparison(groups, synthesis)
+        result["errors"] = errors
+        result["requests"] = requests
+        self._last = (key, result)
+        return result
+
+def merge_comparison(groups: List[Dict[str, Any]], synthesis: Dict[str, Any]) -> Dict[str, Any]:
+    # The overview/similarities/differences/future_research sections of the single-prompt
+    # comparison, rebuilt from the group results, plus the groups themselves
+    compared = [group for group in groups if len(group["papers"]) > 1]
+    overview = str(synthesis.get("overview") or "")
+    if not overview and len(compared) == 1:
+        overview = compared[0]["theme"]
+    similarities = []
+    differences = []
+    future_research = []
+    for group in compared:
+        label = ", ".join(group["papers"])
+        if group["similarities"]:
+            similarities.append(f"**{label}**\n{_bullets(group['similarities'])}")
+        if group["differences"]:
+            differences.append(f"**{label}**\n{_bullets(group['differences'])}")
+        future_research.extend(group["future_research"])
+    if synthesis.get("differences"):
+        differences.append(f"**Across groups**\n{_bullets(_items(synthesis['differences']))}")
+    future_research.extend(_items(synthesis.get("future_research")))
+    return {
+        "overview": overview,
+        "similarities": "\n\n".join(similarities),
+        "differences": "\n\n".join(differences),
+        "future_research": _bullets(list(dict.fromkeys(future_research))),
+        "groups": [{key: group[key] for key in ("paper_ids", "papers", "theme")} for group in groups],
+    }
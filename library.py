@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from cache_utils import DEFAULT_CACHE_DIR, hash_text
+
+# Paper bodies kept in memory beyond the largest set requested at once; everything else
+# is read from disk on demand
+BODY_CACHE_SIZE = 32
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    page_starts TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    pages INTEGER NOT NULL,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    paper_id TEXT NOT NULL REFERENCES papers (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (paper_id, kind, key)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+    name, content, content='papers', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS papers_fts_insert AFTER INSERT ON papers BEGIN
+    INSERT INTO papers_fts (rowid, name, content) VALUES (new.rowid, new.name, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_fts_delete AFTER DELETE ON papers BEGIN
+    INSERT INTO papers_fts (papers_fts, rowid, name, content) VALUES ('delete', old.rowid, old.name, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_fts_update AFTER UPDATE ON papers BEGIN
+    INSERT INTO papers_fts (papers_fts, rowid, name, content) VALUES ('delete', old.rowid, old.name, old.content);
+    INSERT INTO papers_fts (rowid, name, content) VALUES (new.rowid, new.name, new.content);
+END;
+"""
+
+def fts_query(text: str) -> str:
+    # Each word becomes a quoted prefix term, so user input never hits FTS5 query syntax
+    terms = ['"' + word.replace('"', '""') + '"*' for word in text.split()]
+    return " ".join(terms)
+
+# Papers keyed by the SHA-256 of their text, with per-page offsets and derived artifacts
+# (analyses, summaries, citations). The text lives once in the papers table and is
+# indexed through an external-content FTS5 table kept in sync by triggers. Listing and
+# searching return metadata only; bodies are loaded per paper and kept in a small LRU.
+class PaperLibrary:
+    def __init__(self, path: Optional[str] = None):
+        path = path or os.path.join(DEFAULT_CACHE_DIR, "library.sqlite3")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._bodies: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._body_capacity = BODY_CACHE_SIZE
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def add_paper(self, name: str, content: str, page_starts: Optional[List[int]] = None) -> str:
+        paper_id = hash_text(content)
+        page_starts = page_starts or [0]
+        with self._lock:
+            row = self._conn.execute("SELECT name FROM papers WHERE id = ?", (paper_id,)).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO papers (id, name, content, page_starts, chars, pages, added) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (paper_id, name, content, json.dumps(page_starts), len(content), len(page_starts), time.time()),
+                )
+                self._conn.commit()
+            elif row[0] != name:
+                # The same text re-added under another name takes the newer name
+                self._conn.execute("UPDATE papers SET name = ? WHERE id = ?", (name, paper_id))
+                self._conn.commit()
+                if paper_id in self._bodies:
+                    self._bodies[paper_id] = dict(self._bodies[paper_id], name=name)
+        return paper_id
+
+    def __contains__(self, paper_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM papers WHERE id = ?", (paper_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+    def list_papers(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, name, chars, pages, added FROM papers ORDER BY added DESC").fetchall()
+        return [{"id": r[0], "name": r[1], "chars": r[2], "pages": r[3], "added": r[4]} for r in rows]
+
+    def get_paper(self, paper_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if paper_id in self._bodies:
+                self._bodies.move_to_end(paper_id)
+                return self._bodies[paper_id]
+            row = self._conn.execute("SELECT name, content, page_starts FROM papers WHERE id = ?", (paper_id,)).fetchone()
+            if row is None:
+                return None
+            paper = {"id": paper_id, "name": row[0], "content": row[1], "page_starts": json.loads(row[2])}
+            self._bodies[paper_id] = paper
+            if len(self._bodies) > self._body_capacity:
+                self._bodies.popitem(last=False)
+            return paper
+
+    def get_papers(self, paper_ids: List[str]) -> List[Dict[str, Any]]:
+        # The cache grows to hold the largest set requested together, so loading the same
+        # papers on every Streamlit rerun never evicts one of them to make room for another
+        with self._lock:
+            self._body_capacity = max(self._body_capacity, len(paper_ids) + BODY_CACHE_SIZE)
+        return [paper for paper in (self.get_paper(paper_id) for paper_id in paper_ids) if paper is not None]
+
+    def get_page(self, paper_id: str, page: int) -> Optional[str]:
+        # Pages are 1-based, matching the page numbers shown in search results
+        paper = self.get_paper(paper_id)
+        if paper is None or not 1 <= page <= len(paper["page_starts"]):
+            return None
+        starts = paper["page_starts"] + [len(paper["content"])]
+        return paper["content"][starts[page - 1]:starts[page]]
+
+    def remove_paper(self, paper_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM papers WHERE id = ?", (paper_id,))
+            self._conn.commit()
+            self._bodies.pop(paper_id, None)
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT p.id, p.name, snippet(papers_fts, 1, '<mark>', '</mark>', ' … ', 24), bm25(papers_fts) "
+                "FROM papers_fts JOIN papers p ON p.rowid = papers_fts.rowid "
+                "WHERE papers_fts MATCH ? ORDER BY bm25(papers_fts) LIMIT ?",
+                (match, limit),
+            ).fetchall()
+        # bm25() is lower-is-better; flip the sign so larger scores rank higher like the other indexes
+        return [{"id": r[0], "name": r[1], "snippet": r[2], "score": -r[3]} for r in rows]
+
+    def set_artifact(self, paper_id: str, kind: str, key: str, value: Any) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts (paper_id, kind, key, value, created) VALUES (?, ?, ?, ?, ?)",
+                (paper_id, kind, key, json.dumps(value), time.time()),
+            )
+            self._conn.commit()
+
+    def get_artifact(self, paper_id: str, kind: str, key: str = "", default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM artifacts WHERE paper_id = ? AND kind = ? AND key = ?", (paper_id, kind, key),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def artifacts(self, kind: str, key: str = "") -> Dict[str, Any]:
+        # One artifact per paper, e.g. every stored MinHash signature
+        with self._lock:
+            rows = self._conn.execute("SELECT paper_id, value FROM artifacts WHERE kind = ? AND key = ?", (kind, key)).fetchall()
+        return {paper_id: json.loads(value) for paper_id, value in rows}
+
+    def artifact_kinds(self, paper_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT kind FROM artifacts WHERE paper_id = ? ORDER BY kind", (paper_id,)).fetchall()
+        return [r[0] for r in rows]
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+def get_library(path: Optional[str] = None) -> PaperLibrary:
+    # One connection per library file, shared by every Streamlit session in the process
+    with _libraries_lock:
+        if path not in _libraries:
+            _libraries[path] = PaperLibrary(path)
+        return _libraries[path]
@@ -0,0 +1,296 @@
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from google.api_core import exceptions as google_exceptions
+from cache_utils import get_cache, hash_text
+from metrics import metrics, track
+
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Rough token estimate for Gemini models; good enough for keeping prompts under budget
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+MODEL_NAME = "gemini-1.5-flash"
+
+# google.generativeai takes most of a second to import, so it is loaded with the first
+# model instead of at startup
+def configure_api(api_key: str) -> None:
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+
+def build_model(temperature: float = 0.7, max_output_tokens: int = 1024, model_name: str = MODEL_NAME):
+    import google.generativeai as genai
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config={
+            "temperature": temperature,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": max_output_tokens,
+        },
+    )
+
+# Timings of recent streamed responses, newest last
+recent_latencies = deque(maxlen=200)
+
+# Blocking token bucket: refills at rate tokens per second up to capacity
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+# The bucket of the RequestScheduler running the current task, if any. Model calls take
+# a token only when they miss the response cache, so cached answers are not rate limited.
+_active = threading.local()
+
+def acquire_request_slot() -> None:
+    bucket = getattr(_active, "bucket", None)
+    if bucket is not None:
+        bucket.acquire()
+
+# Runs independent model calls on a thread pool with a concurrency cap, a shared rate
+# limit and jittered exponential backoff. The Gemini SDK is blocking, so threads give
+# real overlap of network round trips without an event loop inside Streamlit.
+class RequestScheduler:
+    def __init__(self, max_concurrency: int = 4, requests_per_minute: float = 60,
+                 max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 retry_on: Tuple[type, ...] = (google_exceptions.GoogleAPIError,)):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(requests_per_minute / 60.0, capacity=max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps concurrent retries from hitting the API in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        # fn takes a token from the bucket through acquire_request_slot before each real request
+        attempt = 0
+        previous = getattr(_active, "bucket", None)
+        _active.bucket = self.bucket
+        try:
+            while True:
+                try:
+                    return fn()
+                except self.retry_on:
+                    if attempt >= self.max_retries:
+                        raise
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+        finally:
+            _active.bucket = previous
+
+    # Returns one (result, error) pair per task, in input order. on_done(index, result, error)
+    # runs on the calling thread as each task finishes, so it may update Streamlit elements.
+    def run(self, tasks: List[Callable[[], Any]],
+            on_done: Optional[Callable[[int, Any, Optional[Exception]], None]] = None) -> List[Tuple[Any, Optional[Exception]]]:
+        results: List[Tuple[Any, Optional[Exception]]] = [(None, None)] * len(tasks)
+        if not tasks:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(tasks))) as executor:
+            futures = {executor.submit(self.call, task): index for index, task in enumerate(tasks)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = (future.result(), None)
+                except Exception as e:
+                    results[index] = (None, e)
+                if on_done:
+                    on_done(index, *results[index])
+        return results
+
+def model_fingerprint(model) -> Dict[str, Any]:
+    # Accepts a GenerativeModel or a ChatSession wrapping one
+    model = getattr(model, "model", model)
+    config = dict(getattr(model, "_generation_config", None) or {})
+    return {
+        "model": getattr(model, "model_name", type(model).__name__),
+        "temperature": config.get("temperature"),
+        "top_p": config.get("top_p"),
+        "top_k": config.get("top_k"),
+        "max_output_tokens": config.get("max_output_tokens"),
+    }
+
+def response_cache_key(model, prompt: str) -> str:
+    return hash_text(json.dumps([model_fingerprint(model), prompt], sort_keys=True))
+
+def get_response_cache():
+    return get_cache("llm_responses", max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL)
+
+def record_usage(prompt: str, text: str, usage: Any = None) -> None:
+    # Token counts reported by the API when available, otherwise the character estimate
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt)
+    response_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(text or "")
+    metrics.increment("llm_tokens_total", prompt_tokens, kind="prompt")
+    metrics.increment("llm_tokens_total", response_tokens, kind="response")
+
+# call returns the model response; only its text is cached
+def cached_response(model, prompt: str, call: Callable[[], Any]) -> str:
+    # Identical prompts against the same model settings are answered from disk
+    cache = get_response_cache()
+    key = response_cache_key(model, prompt)
+    text = cache.get(key)
+    if text is None:
+        acquire_request_slot()
+        with track("llm_request"):
+            response = call()
+        text = response.text
+        record_usage(prompt, text, getattr(response, "usage_metadata", None))
+        if text:
+            cache.set(key, text)
+    return text
+
+def stream_response(model, contents, on_chunk: Callable[[str], None], cache_prompt: Optional[str] = None) -> str:
+    # Streams a response, calling on_chunk with the text received so far. A cached
+    # response is delivered as a single chunk.
+    cache = get_response_cache()
+    key = response_cache_key(model, cache_prompt if cache_prompt is not None else contents)
+    text = cache.get(key)
+    if text is not None:
+        on_chunk(text)
+        return text
+    parts = []
+    usage = None
+    acquire_request_slot()
+    with track("llm_request"):
+        for chunk in model.generate_content(contents, stream=True):
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            piece = chunk.text
+            if piece:
+                parts.append(piece)
+                on_chunk("".join(parts))
+    text = "".join(parts)
+    record_usage(cache_prompt if cache_prompt is not None else contents, text, usage)
+    if text:
+        cache.set(key, text)
+    return text
+
+def generate_text(model, prompt: str, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    if on_chunk:
+        return stream_response(model, prompt, on_chunk)
+    return cached_response(model, prompt, lambda: model.generate_content(prompt))
+
+# Wraps an on_chunk callback to time a streamed response: time to first token and total latency
+class StreamTimer:
+    def __init__(self, on_chunk: Callable[[str], None], task: str = "generate"):
+        self.on_chunk = on_chunk
+        self.task = task
+        self.start = time.perf_counter()
+        self.time_to_first_token: Optional[float] = None
+
+    def __call__(self, text: str) -> None:
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.start
+        self.on_chunk(text)
+
+    def finish(self) -> Dict[str, Any]:
+        record = {
+            "task": self.task,
+            "time_to_first_token": self.time_to_first_token,
+            "total": time.perf_counter() - self.start,
+        }
+        recent_latencies.append(record)
+        if self.time_to_first_token is not None:
+            metrics.observe("time_to_first_token_seconds", self.time_to_first_token, task=self.task)
+        metrics.observe("response_seconds", record["total"], task=self.task)
+        return record
+
+def format_timing(record: Dict[str, Any]) -> str:
+    if record["time_to_first_token"] is None:
+        return f"Completed in {record['total']:.2f}s"
+    return f"First token after {record['time_to_first_token']:.2f}s, complete after {record['total']:.2f}s"
+
+COMPACTION_PROMPT = """Summarize the following conversation about research papers in a few sentences. Keep every fact, number, paper name and open question that a follow-up question might depend on.
+
+{conversation}"""
+
+# Q&A is the only task that needs history. Instead of an unbounded ChatSession, each turn
+# is sent as a stateless generate_content call carrying a summary of older turns plus
+# the most recent turns verbatim, and the history is compacted once it exceeds
+# max_history_tokens.
+class QAChat:
+    def __init__(self, model, max_history_tokens: int = 4000, keep_turns: int = 4):
+        self.model = model
+        self.max_history_tokens = max_history_tokens
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.turns: List[Tuple[str, str]] = []
+
+    def history_tokens(self) -> int:
+        return estimate_tokens(self.summary) + self._turn_tokens(self.turns)
+
+    def contents(self, message: str) -> List[Dict[str, Any]]:
+        contents = []
+        if self.summary:
+            contents.append({"role": "user", "parts": [f"Summary of our earlier conversation: {self.summary}"]})
+            contents.append({"role": "model", "parts": ["Understood."]})
+        for question, answer in self.turns:
+            contents.append({"role": "user", "parts": [question]})
+            contents.append({"role": "model", "parts": [answer]})
+        contents.append({"role": "user", "parts": [message]})
+        return contents
+
+    # message is what the model sees for this turn (e.g. a prompt with retrieved excerpts);
+    # record_as is what is kept in history, so bulky context is not replayed every turn
+    def send(self, message: str, record_as: Optional[str] = None, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        contents = self.contents(message)
+        if on_chunk:
+            answer = stream_response(self.model, contents, on_chunk, cache_prompt=json.dumps(contents))
+        else:
+            answer = cached_response(self.model, json.dumps(contents), lambda: self.model.generate_content(contents))
+        if answer:
+            self.turns.append((record_as or message, answer))
+            self.compact()
+        return answer
+
+    def _turn_tokens(self, turns: List[Tuple[str, str]]) -> int:
+        return sum(estimate_tokens(q) + estimate_tokens(a) for q, a in turns)
+
+    def compact(self) -> None:
+        # Oldest turns are folded into the summary until the history fits. At most keep_turns
+        # recent turns stay verbatim, fewer when they alone are over the cap, and the latest
+        # turn is always kept.
+        while self.history_tokens() > self.max_history_tokens and len(self.turns) > 1:
+            split = max(len(self.turns) - self.keep_turns, 1)
+            budget = self.max_history_tokens - estimate_tokens(self.summary)
+            while split < len(self.turns) - 1 and self._turn_tokens(self.turns[split:]) > budget:
+                split += 1
+            older, self.turns = self.turns[:split], self.turns[split:]
+            conversation = "\n\n".join(f"Q: {q}\nA: {a}" for q, a in older)
+            if self.summary:
+                conversation = f"Earlier summary: {self.summary}\n\n{conversation}"
+            try:
+                self.summary = generate_text(self.model, COMPACTION_PROMPT.format(conversation=conversation))
+            except Exception:
+                # Keep the previous summary; the folded turns are dropped, as in a sliding window
+                pass
+
+    def clear(self) -> None:
+        self.summary = ""
+        self.turns = []
@@ -0,0 +1,147 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Process-wide timings and counters shared by every Streamlit session, the batch CLI and
+# the benchmarks. Summaries keep a count, a sum and a window of recent observations for
+# quantiles; counters only add up. Both are keyed by metric name plus sorted labels.
+
+METRIC_PREFIX = "research_assistant"
+
+# Observations kept per summary for the p50/p95 estimates
+QUANTILE_WINDOW = 512
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+class Metrics:
+    def __init__(self, window: int = QUANTILE_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._summaries: Dict[LabelKey, Dict[str, Any]] = {}
+        self._counters: Dict[LabelKey, float] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> LabelKey:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = {"count": 0, "sum": 0.0, "recent": deque(maxlen=self.window)}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["recent"].append(value)
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    @contextmanager
+    def track(self, stage: str):
+        # Times the block as stage_seconds{stage=...}; failures are also counted
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment("stage_errors_total", stage=stage)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def timed(self, stage: str) -> Callable:
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.track(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        with self._lock:
+            summaries = [(key, summary["count"], summary["sum"], sorted(summary["recent"]))
+                         for key, summary in self._summaries.items()]
+            counters = list(self._counters.items())
+        return {
+            "summaries": [
+                {"name": name, "labels": dict(labels), "count": count, "sum": total,
+                 "p50": _quantile(recent, 0.5), "p95": _quantile(recent, 0.95)}
+                for (name, labels), count, total, recent in sorted(summaries)
+            ],
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(counters)],
+        }
+
+    def cache_hit_ratios(self) -> Dict[str, Dict[str, float]]:
+        ratios = {}
+        for counter in self.snapshot()["counters"]:
+            if counter["name"] == "cache_requests_total":
+                entry = ratios.setdefault(counter["labels"]["cache"], {"hit": 0, "miss": 0})
+                entry[counter["labels"]["result"]] += counter["value"]
+        for entry in ratios.values():
+            lookups = entry["hit"] + entry["miss"]
+            entry["hit_ratio"] = entry["hit"] / lookups if lookups else 0.0
+        return ratios
+
+    def reset(self) -> None:
+        with self._lock:
+            self._summaries.clear()
+            self._counters.clear()
+
+    def to_json(self) -> str:
+        snapshot = self.snapshot()
+        snapshot["cache_hit_ratios"] = self.cache_hit_ratios()
+        return json.dumps(snapshot, indent=2)
+
+    def to_prometheus(self) -> str:
+        # Prometheus text exposition format: summaries with 0.5/0.95 quantiles, then counters
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for summary in snapshot["summaries"]:
+            name = f"{METRIC_PREFIX}_{summary['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            for quantile, value in (("0.5", summary["p50"]), ("0.95", summary["p95"])):
+                lines.append(f"{name}{_labels(summary['labels'], quantile=quantile)} {_number(value)}")
+            lines.append(f"{name}_sum{_labels(summary['labels'])} {_number(summary['sum'])}")
+            lines.append(f"{name}_count{_labels(summary['labels'])} {summary['count']}")
+        for counter in snapshot["counters"]:
+            name = f"{METRIC_PREFIX}_{counter['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(counter['labels'])} {_number(counter['value'])}")
+        return "\n".join(lines) + "\n"
+
+def _quantile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+def _labels(labels: Dict[str, str], **extra) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _number(value: Optional[float]) -> str:
+    return "NaN" if value is None else repr(float(value))
+
+metrics = Metrics()
+track = metrics.track
+timed = metrics.timed
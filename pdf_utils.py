@@ -1,19 +1,173 @@
-import PyPDF2
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional
 import streamlit as st
+from cache_utils import get_cache, hash_bytes
+from metrics import timed
 
-def extract_text_from_pdf(pdf_file) -> str:
+# Bump whenever the extraction logic changes so stale cached text is not reused
+EXTRACTOR_VERSION = 2
+
+# Documents longer than this are split into page ranges so one thesis can use several workers
+PAGES_PER_TASK = 40
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+def read_pdf_bytes(pdf_file) -> bytes:
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    data = pdf_file.read()
+    pdf_file.seek(0)
+    return data
+
+def extraction_cache_key(pdf_bytes: bytes) -> str:
+    return f"v{EXTRACTOR_VERSION}:{hash_bytes(pdf_bytes)}"
+
+def iter_pdf_pages(pdf_file, start_page: int = 0, end_page: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    # Yields one record per page so callers can consume a long document lazily;
+    # start/end are character offsets into the joined text of the pages yielded.
+    # PyPDF2 is imported on first use so pasting text never pays for it
+    import PyPDF2
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(read_pdf_bytes(pdf_file)))
+    offset = 0
+    for page_number in range(start_page, end_page if end_page is not None else len(pdf_reader.pages)):
+        text = pdf_reader.pages[page_number].extract_text() or ""
+        yield {"page": page_number + 1, "text": text, "start": offset, "end": offset + len(text)}
+        offset += len(text)
+
+def page_records(page_texts: List[str]) -> List[Dict[str, Any]]:
+    records = []
+    offset = 0
+    for page_number, text in enumerate(page_texts, start=1):
+        records.append({"page": page_number, "text": text, "start": offset, "end": offset + len(text)})
+        offset += len(text)
+    return records
+
+def page_starts(page_texts: List[str]) -> List[int]:
+    return [record["start"] for record in page_records(page_texts)]
+
+def join_pages(page_texts: List[str]) -> str:
+    return "".join(page_texts)
+
+@timed("pdf_extraction")
+def extract_pages_from_pdf(pdf_file) -> List[str]:
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        
-        if not text.strip():
+        pdf_bytes = read_pdf_bytes(pdf_file)
+        cache = get_cache("pdf_text")
+        cache_key = extraction_cache_key(pdf_bytes)
+        pages = cache.get(cache_key)
+        if pages is not None:
+            return pages
+
+        pages = [record["text"] for record in iter_pdf_pages(io.BytesIO(pdf_bytes))]
+
+        if not any(page.strip() for page in pages):
             st.warning(f"Warning: No text extracted from {pdf_file.name}. The PDF might be scanned or protected.")
         else:
-            st.success(f"Successfully extracted {len(text)} characters from {pdf_file.name}")
-        
-        return text
+            st.success(f"Successfully extracted {sum(len(page) for page in pages)} characters from {pdf_file.name}")
+        cache.set(cache_key, pages)
+
+        return pages
     except Exception as e:
         st.error(f"Error extracting text from {pdf_file.name}: {str(e)}")
-        return ""
+        return []
+
+def extract_text_from_pdf(pdf_file) -> str:
+    return join_pages(extract_pages_from_pdf(pdf_file))
+
+# Forking the threaded Streamlit server can deadlock a child on a lock another thread held.
+# Workers come from a fork server instead, which is single-threaded and has this module and
+# PyPDF2 loaded already, or are spawned fresh where fork servers are not available (Windows)
+def _process_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__, "PyPDF2"])
+    return context
+
+def _extract_page_range(pdf_bytes: bytes, start: int, end: int) -> List[str]:
+    # Runs inside a worker process, so it must stay free of Streamlit calls
+    return [record["text"] for record in iter_pdf_pages(io.BytesIO(pdf_bytes), start, end)]
+
+def _page_ranges(pdf_bytes: bytes) -> List[tuple]:
+    import PyPDF2
+    page_count = len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+    return [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+
+# Cache hits are resolved up front; the remaining files are split into page ranges and
+# fanned out over a process pool. progress_callback(index, pages, error) runs on the
+# calling thread as each file completes, so it may safely update Streamlit elements.
+# Timed as its own stage: pdf_extraction is one file, this is the whole upload.
+@timed("pdf_batch_extraction")
+def extract_pages_from_pdfs(pdf_files, max_workers: int = DEFAULT_WORKERS,
+                            progress_callback: Optional[Callable[[int, List[str], Optional[str]], None]] = None) -> List[List[str]]:
+    cache = get_cache("pdf_text")
+    results = [None] * len(pdf_files)
+    pending = {}
+
+    def finish(index: int, pages: List[str], error: Optional[str] = None):
+        results[index] = pages
+        if progress_callback:
+            progress_callback(index, pages, error)
+
+    for index, pdf_file in enumerate(pdf_files):
+        pdf_bytes = read_pdf_bytes(pdf_file)
+        cache_key = extraction_cache_key(pdf_bytes)
+        pages = cache.get(cache_key)
+        if pages is not None:
+            finish(index, pages)
+            continue
+        try:
+            ranges = _page_ranges(pdf_bytes)
+        except Exception as e:
+            finish(index, [], str(e))
+            continue
+        if not ranges:
+            cache.set(cache_key, [])
+            finish(index, [])
+            continue
+        pending[index] = {"bytes": pdf_bytes, "key": cache_key, "ranges": ranges, "parts": {}, "error": None}
+
+    tasks = [(index, rng) for index, job in pending.items() for rng in job["ranges"]]
+    if not tasks:
+        return results
+
+    def collect(index: int, rng: tuple, pages: Optional[List[str]], error: Optional[str]):
+        job = pending[index]
+        if error:
+            job["error"] = job["error"] or error
+        job["parts"][rng] = pages or []
+        if len(job["parts"]) == len(job["ranges"]):
+            if job["error"]:
+                finish(index, [], job["error"])
+                return
+            pages = [page for rng in job["ranges"] for page in job["parts"][rng]]
+            cache.set(job["key"], pages)
+            finish(index, pages)
+
+    if max_workers <= 1 or len(tasks) == 1:
+        for index, rng in tasks:
+            try:
+                collect(index, rng, _extract_page_range(pending[index]["bytes"], *rng), None)
+            except Exception as e:
+                collect(index, rng, None, str(e))
+        return results
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)), mp_context=_process_context()) as executor:
+        futures = {
+            executor.submit(_extract_page_range, pending[index]["bytes"], *rng): (index, rng)
+            for index, rng in tasks
+        }
+        for future in as_completed(futures):
+            index, rng = futures[future]
+            try:
+                collect(index, rng, future.result(), None)
+            except Exception as e:
+                collect(index, rng, None, str(e))
+    return results
+
+def extract_texts_from_pdfs(pdf_files, max_workers: int = DEFAULT_WORKERS,
+                            progress_callback: Optional[Callable[[int, List[str], Optional[str]], None]] = None) -> List[str]:
+    return [join_pages(pages) for pages in extract_pages_from_pdfs(pdf_files, max_workers, progress_callback)]
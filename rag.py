@@ -0,0 +1,46 @@
+from typing import List, Dict, Any, Tuple, Callable, Optional
+from analysis import ask_question
+from llm_client import estimate_tokens
+
+RAG_INSTRUCTIONS = """Answer the question using only the excerpts from the uploaded research papers below. Cite the paper name and page for each claim, e.g. (paper.pdf, p. 3). If the excerpts do not contain the answer, say so instead of guessing."""
+
+def retrieve_passages(index, papers: List[Dict[str, Any]], question: str, top_k: int = 8) -> List[Dict[str, Any]]:
+    papers_by_id = {paper['id']: paper for paper in papers}
+    passages = []
+    for result in index.search(question, top_k=top_k):
+        if result['score'] <= 0:
+            continue
+        paper = papers_by_id[result['doc_id']]
+        passages.append({
+            "name": paper['name'],
+            "page": result['page'],
+            "score": result['score'],
+            "text": paper['content'][result['start']:result['end']].strip(),
+        })
+    return passages
+
+def build_rag_prompt(question: str, passages: List[Dict[str, Any]], max_tokens: int) -> Tuple[str, List[Dict[str, Any]]]:
+    # Passages arrive best first and are added until the next one would exceed the budget
+    header = f"{RAG_INSTRUCTIONS}\n\nQuestion: {question}\n\nExcerpts:"
+    budget = max_tokens - estimate_tokens(header)
+    used = []
+    blocks = []
+    for passage in passages:
+        block = f"[{len(used) + 1}] {passage['name']}, p. {passage['page']}:\n{passage['text']}"
+        cost = estimate_tokens(block) + 1
+        if cost > budget:
+            continue
+        budget -= cost
+        used.append(passage)
+        blocks.append(block)
+    return header + "\n\n" + "\n\n".join(blocks), used
+
+def answer_question(qa_chat, index, papers: List[Dict[str, Any]], question: str,
+                    max_tokens: int = 2000, top_k: int = 8,
+                    on_chunk: Optional[Callable[[str], None]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+    passages = retrieve_passages(index, papers, question, top_k)
+    if not passages:
+        return ask_question(qa_chat, question, on_chunk=on_chunk), []
+    prompt, used = build_rag_prompt(question, passages, max_tokens)
+    # Only the bare question goes into the chat history; the excerpts are sent for this turn alone
+    return ask_question(qa_chat, prompt, record_as=question, on_chunk=on_chunk), used
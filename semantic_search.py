@@ -1,29 +1,454 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from metrics import timed
+import numpy as np
+import hashlib
+import json
+import os
 import re
+import shutil
+import tempfile
+import weakref
 
-def perform_semantic_search(query: str, corpus: List[str], top_k: int = 5) -> List[Dict[str, Any]]:
-    # Create TF-IDF vectorizer
-    vectorizer = TfidfVectorizer()
-    
-    # Fit and transform the corpus
-    corpus_vectors = vectorizer.fit_transform(corpus)
-    
-    # Transform the query
-    query_vector = vectorizer.transform([query])
-    
-    # Calculate cosine similarities
-    similarities = cosine_similarity(query_vector, corpus_vectors)[0]
-    
-    # Get top k results
-    top_k_indices = similarities.argsort()[-top_k:][::-1]
-    top_k_scores = similarities[top_k_indices]
-    
-    return [{"corpus_id": idx, "score": score} for idx, score in zip(top_k_indices, top_k_scores)]
-
-def highlight_text(text: str, query: str) -> str:
-    words = query.lower().split()
-    pattern = r'\b(' + '|'.join(re.escape(word) for word in words) + r')\b'
-    highlighted = re.sub(pattern, r'<mark>\1</mark>', text, flags=re.IGNORECASE)
-    return highlighted
+# scikit-learn and scipy take over a second to import, so they are loaded on first use
+# rather than when the app starts; tokenizing needs neither
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+def analyze(text: str) -> List[str]:
+    # Same tokens as TfidfVectorizer's default analyzer: lowercased runs of two or more word characters
+    return TOKEN_PATTERN.findall(text.lower())
+
+# Passages are overlapping character windows snapped to word boundaries, small enough
+# that a hit points at the relevant part of a paper rather than the whole document
+PASSAGE_CHARS = 1200
+PASSAGE_OVERLAP = 200
+
+def page_for_offset(page_starts: List[int], offset: int) -> int:
+    return max(bisect_right(page_starts, offset), 1)
+
+def split_into_passages(text: str, page_starts: Optional[List[int]] = None,
+                        passage_chars: int = PASSAGE_CHARS, overlap: int = PASSAGE_OVERLAP) -> List[Dict[str, int]]:
+    page_starts = page_starts or [0]
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(start + passage_chars, len(text))
+        if end < len(text):
+            cut = text.rfind(" ", start + passage_chars // 2, end)
+            if cut > start:
+                end = cut
+        passages.append({"start": start, "end": end, "page": page_for_offset(page_starts, start)})
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return passages
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    # argpartition selects the k best in linear time; only those k are sorted
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+# TF-IDF index over paper passages. Each passage is tokenized once and its raw term counts
+# kept, so adding or removing a paper only updates document frequencies. Weights match
+# TfidfVectorizer's defaults (smooth idf, l2 norm); all passages are scored as one sparse
+# matrix and a query costs one transform plus a sparse mat-vec.
+class SearchIndex:
+    def __init__(self, passage_chars: int = PASSAGE_CHARS, overlap: int = PASSAGE_OVERLAP):
+        self._analyzer = analyze
+        self.passage_chars = passage_chars
+        self.overlap = overlap
+        self.vocabulary: Dict[str, int] = {}
+        self.doc_ids: List[str] = []
+        self.passages: List[Dict[str, Any]] = []
+        self._passage_counts: List[Dict[int, int]] = []
+        self._doc_freq: Dict[int, int] = {}
+        self._matrix = None
+        self._idf = None
+        self._passage_docs = None
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_ids
+
+    def add(self, doc_id: str, text: str, page_starts: Optional[List[int]] = None) -> None:
+        if doc_id in self.doc_ids:
+            self.remove(doc_id)
+        for passage in split_into_passages(text, page_starts, self.passage_chars, self.overlap):
+            counts: Dict[int, int] = {}
+            for term in self._analyzer(text[passage["start"]:passage["end"]]):
+                term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            for term_id in counts:
+                self._doc_freq[term_id] = self._doc_freq.get(term_id, 0) + 1
+            self.passages.append(dict(passage, doc_id=doc_id))
+            self._passage_counts.append(counts)
+        self.doc_ids.append(doc_id)
+        self._matrix = None
+
+    def remove(self, doc_id: str) -> None:
+        if doc_id not in self.doc_ids:
+            return
+        keep = [i for i, passage in enumerate(self.passages) if passage["doc_id"] != doc_id]
+        for i, passage in enumerate(self.passages):
+            if passage["doc_id"] == doc_id:
+                for term_id in self._passage_counts[i]:
+                    self._doc_freq[term_id] -= 1
+        self.passages = [self.passages[i] for i in keep]
+        self._passage_counts = [self._passage_counts[i] for i in keep]
+        self.doc_ids.remove(doc_id)
+        self._matrix = None
+
+    @timed("search_index_update")
+    def sync(self, papers: List[Dict[str, Any]]) -> None:
+        # Bring the index in line with the loaded papers, touching only the difference
+        wanted = {paper["id"]: paper for paper in papers}
+        for doc_id in [doc_id for doc_id in self.doc_ids if doc_id not in wanted]:
+            self.remove(doc_id)
+        for doc_id, paper in wanted.items():
+            if doc_id not in self.doc_ids:
+                self.add(doc_id, paper["content"], paper.get("page_starts"))
+
+    @timed("search_index_build")
+    def _build(self) -> None:
+        from scipy import sparse
+        n_terms = len(self.vocabulary)
+        indptr = [0]
+        indices = []
+        data = []
+        for counts in self._passage_counts:
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        counts = sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(self.passages), n_terms),
+        )
+        doc_freq = np.zeros(n_terms)
+        for term_id, freq in self._doc_freq.items():
+            doc_freq[term_id] = freq
+        self._idf = np.log((1 + len(self.passages)) / (1 + doc_freq)) + 1
+        weighted = counts.multiply(self._idf).tocsr()
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        # Fold idf and row norms into the stored matrix so scoring is a single product
+        self._matrix = (sparse.diags(1.0 / norms) @ weighted).tocsr()
+        positions = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        self._passage_docs = np.array([positions[passage["doc_id"]] for passage in self.passages], dtype=np.int64)
+
+    def transform(self, query: str) -> np.ndarray:
+        if self._matrix is None:
+            self._build()
+        vector = np.zeros(len(self.vocabulary))
+        for term in self._analyzer(query):
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                vector[term_id] += 1
+        vector *= self._idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @timed("semantic_search")
+    def score(self, query: str) -> np.ndarray:
+        if not self.passages:
+            return np.zeros(0)
+        query_vector = self.transform(query)
+        return self._matrix @ query_vector
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        # Best passages across the library, each with paper id, page and character offsets;
+        # passages sharing no term with the query score 0 and are left out
+        scores = self.score(query)
+        return [dict(self.passages[idx], score=float(scores[idx])) for idx in top_k_indices(scores, top_k)
+                if scores[idx] > 0]
+
+    def search_documents(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        # Papers ranked by their best matching passage
+        scores = self.score(query)
+        doc_scores = np.zeros(len(self.doc_ids))
+        if len(scores):
+            np.maximum.at(doc_scores, self._passage_docs, scores)
+        return [{"doc_id": self.doc_ids[idx], "score": float(doc_scores[idx])} for idx in top_k_indices(doc_scores, top_k)
+                if doc_scores[idx] > 0]
+
+    @timed("document_similarity")
+    def document_similarity(self, doc_ids: Optional[List[str]] = None) -> np.ndarray:
+        # Cosine similarity between papers, each represented by the normalized sum of its
+        # passage vectors; rows and columns follow doc_ids (default: every indexed paper).
+        # Papers that are not indexed get zero similarity to everything.
+        from scipy import sparse
+        doc_ids = self.doc_ids if doc_ids is None else doc_ids
+        if not self.passages or not doc_ids:
+            return np.zeros((len(doc_ids), len(doc_ids)))
+        if self._matrix is None:
+            self._build()
+        positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        rows = [positions.get(self.doc_ids[doc]) for doc in self._passage_docs]
+        kept = [i for i, row in enumerate(rows) if row is not None]
+        membership = sparse.csr_matrix(
+            (np.ones(len(kept)), ([rows[i] for i in kept], kept)), shape=(len(doc_ids), len(self.passages)),
+        )
+        documents = (membership @ self._matrix).tocsr()
+        norms = np.sqrt(np.asarray(documents.multiply(documents).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        documents = sparse.diags(1.0 / norms) @ documents
+        return (documents @ documents.T).toarray()
+
+EMBEDDING_DIM = 256
+
+# Deterministic local stand-in for a learned embedding model. Words and their character
+# trigrams are hashed into signed buckets (a sparse random projection of the bag of
+# features), so inflected or reordered phrasings still land close together. Any object
+# exposing name, dim and embed(texts) -> float32 array can be used instead.
+class HashingEmbedder:
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        self._analyzer = analyze
+        self._buckets: Dict[str, tuple] = {}
+
+    def _bucket(self, feature: str) -> tuple:
+        bucket = self._buckets.get(feature)
+        if bucket is None:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            bucket = (digest % self.dim, 1.0 if (digest >> 63) & 1 else -1.0)
+            self._buckets[feature] = bucket
+        return bucket
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in self._analyzer(text):
+                column, sign = self._bucket(word)
+                vectors[row, column] += sign
+                padded = f"<{word}>"
+                for i in range(len(padded) - 2):
+                    column, sign = self._bucket(padded[i:i + 3])
+                    vectors[row, column] += 0.5 * sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+# Float32 vectors in a memory-mapped .npy file with passage provenance kept in compact
+# NumPy arrays beside it. Capacity doubles as rows are appended and similarity is computed
+# in fixed-size row blocks, so only one block of vectors is paged in at a time.
+class VectorStore:
+    def __init__(self, path: str, dim: int, block_rows: int = 65536):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dim = dim
+        self.block_rows = block_rows
+        self._vectors_path = os.path.join(path, "vectors.npy")
+        self._meta_path = os.path.join(path, "meta.npz")
+        self._docs_path = os.path.join(path, "docs.json")
+        if os.path.exists(self._meta_path) and os.path.exists(self._docs_path):
+            meta = np.load(self._meta_path)
+            self.doc_rows, self.starts, self.ends, self.pages = (meta[key] for key in ("doc_rows", "starts", "ends", "pages"))
+            with open(self._docs_path) as f:
+                self.doc_ids: List[str] = json.load(f)
+            self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        else:
+            self.doc_rows, self.starts, self.ends, self.pages = (np.zeros(0, dtype=np.int64) for _ in range(4))
+            self.doc_ids = []
+            self._vectors = np.lib.format.open_memmap(self._vectors_path, mode="w+", dtype=np.float32, shape=(1024, dim))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _reserve(self, rows: int) -> None:
+        capacity = self._vectors.shape[0]
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        grown_path = self._vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(grown_path, mode="w+", dtype=np.float32, shape=(capacity, self.dim))
+        grown[:len(self)] = self._vectors[:len(self)]
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(grown_path, self._vectors_path)
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+
+    def add(self, doc_id: str, vectors: np.ndarray, passages: List[Dict[str, int]]) -> None:
+        count = len(self)
+        self._reserve(count + len(vectors))
+        self._vectors[count:count + len(vectors)] = vectors
+        self.doc_ids.append(doc_id)
+        doc_row = len(self.doc_ids) - 1
+        self.doc_rows = np.concatenate([self.doc_rows, np.full(len(passages), doc_row, dtype=np.int64)])
+        self.starts = np.concatenate([self.starts, np.array([p["start"] for p in passages], dtype=np.int64)])
+        self.ends = np.concatenate([self.ends, np.array([p["end"] for p in passages], dtype=np.int64)])
+        self.pages = np.concatenate([self.pages, np.array([p["page"] for p in passages], dtype=np.int64)])
+        self._save()
+
+    def remove(self, doc_id: str) -> None:
+        if doc_id not in self.doc_ids:
+            return
+        doc_row = self.doc_ids.index(doc_id)
+        keep = np.flatnonzero(self.doc_rows != doc_row)
+        # Compact the surviving rows in place, one block at a time
+        for block_start in range(0, len(keep), self.block_rows):
+            rows = keep[block_start:block_start + self.block_rows]
+            self._vectors[block_start:block_start + len(rows)] = self._vectors[rows]
+        self.doc_rows = self.doc_rows[keep]
+        self.doc_rows[self.doc_rows > doc_row] -= 1
+        self.starts, self.ends, self.pages = self.starts[keep], self.ends[keep], self.pages[keep]
+        del self.doc_ids[doc_row]
+        self._save()
+
+    def _save(self) -> None:
+        self._vectors.flush()
+        np.savez(self._meta_path, doc_rows=self.doc_rows, starts=self.starts, ends=self.ends, pages=self.pages)
+        with open(self._docs_path, "w") as f:
+            json.dump(self.doc_ids, f)
+
+    def similarities(self, query_vector: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self), dtype=np.float32)
+        for block_start in range(0, len(self), self.block_rows):
+            block_end = min(block_start + self.block_rows, len(self))
+            scores[block_start:block_end] = self._vectors[block_start:block_end] @ query_vector
+        return scores
+
+# Dense counterpart of SearchIndex with the same sync/search interface, backed by an
+# embedding model and a VectorStore on disk
+class DenseSearchIndex:
+    def __init__(self, path: Optional[str] = None, embedder=None,
+                 passage_chars: int = PASSAGE_CHARS, overlap: int = PASSAGE_OVERLAP):
+        self.embedder = embedder or HashingEmbedder()
+        self.path = path or tempfile.mkdtemp(prefix=f"{self.embedder.name}-")
+        self.store = VectorStore(self.path, self.embedder.dim)
+        if path is None:
+            # A scratch store belongs to this index (one per session) and goes away with it
+            weakref.finalize(self, shutil.rmtree, self.path, True)
+        self.passage_chars = passage_chars
+        self.overlap = overlap
+
+    @property
+    def doc_ids(self) -> List[str]:
+        return self.store.doc_ids
+
+    def __len__(self) -> int:
+        return len(self.store.doc_ids)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.store.doc_ids
+
+    def add(self, doc_id: str, text: str, page_starts: Optional[List[int]] = None, batch_size: int = 256) -> None:
+        if doc_id in self.store.doc_ids:
+            self.remove(doc_id)
+        passages = split_into_passages(text, page_starts, self.passage_chars, self.overlap)
+        vectors = np.zeros((len(passages), self.embedder.dim), dtype=np.float32)
+        for batch_start in range(0, len(passages), batch_size):
+            batch = passages[batch_start:batch_start + batch_size]
+            vectors[batch_start:batch_start + len(batch)] = self.embedder.embed([text[p["start"]:p["end"]] for p in batch])
+        self.store.add(doc_id, vectors, passages)
+
+    def remove(self, doc_id: str) -> None:
+        self.store.remove(doc_id)
+
+    @timed("dense_index_update")
+    def sync(self, papers: List[Dict[str, Any]]) -> None:
+        wanted = {paper["id"]: paper for paper in papers}
+        for doc_id in [doc_id for doc_id in self.store.doc_ids if doc_id not in wanted]:
+            self.remove(doc_id)
+        for doc_id, paper in wanted.items():
+            if doc_id not in self.store.doc_ids:
+                self.add(doc_id, paper["content"], paper.get("page_starts"))
+
+    @timed("dense_search")
+    def score(self, query: str) -> np.ndarray:
+        if not len(self.store):
+            return np.zeros(0, dtype=np.float32)
+        return self.store.similarities(self.embedder.embed([query])[0])
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        scores = self.score(query)
+        store = self.store
+        return [
+            {"doc_id": store.doc_ids[store.doc_rows[idx]], "start": int(store.starts[idx]), "end": int(store.ends[idx]),
+             "page": int(store.pages[idx]), "score": float(scores[idx])}
+            for idx in top_k_indices(scores, top_k)
+        ]
+
+    def search_documents(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        scores = self.score(query)
+        doc_scores = np.full(len(self.store.doc_ids), -1.0)
+        if len(scores):
+            np.maximum.at(doc_scores, self.store.doc_rows, scores)
+        return [{"doc_id": self.store.doc_ids[idx], "score": float(doc_scores[idx])} for idx in top_k_indices(doc_scores, top_k)]
+
+# Context shown around matches when a passage is rendered
+HIGHLIGHT_WINDOW_CHARS = 400
+HIGHLIGHT_MAX_WINDOWS = 2
+
+@lru_cache(maxsize=256)
+def query_pattern(query: str) -> Optional[re.Pattern]:
+    # One compiled alternation per distinct query, longest words first so overlapping terms prefer the longer match
+    words = sorted(set(query.lower().split()), key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile(r'\b(' + '|'.join(re.escape(word) for word in words) + r')\b', re.IGNORECASE)
+
+def best_match_windows(text: str, query: str, start: int = 0, end: Optional[int] = None,
+                       window_chars: int = HIGHLIGHT_WINDOW_CHARS, max_windows: int = HIGHLIGHT_MAX_WINDOWS) -> List[Dict[str, Any]]:
+    # Scans text[start:end] once and returns up to max_windows non-overlapping windows, in text
+    # order, that cover the most distinct query terms (then the most matches). Each window has
+    # absolute start/end offsets and the absolute (start, end) of the matches inside it.
+    end = len(text) if end is None else end
+    pattern = query_pattern(query)
+    matches = [(m.start(), m.end(), m.group(1).lower()) for m in pattern.finditer(text, start, end)] if pattern else []
+    if not matches:
+        return [{"start": start, "end": min(end, start + window_chars), "matches": []}]
+    starts = [m_start for m_start, _, _ in matches]
+    candidates = []
+    j = 0
+    for i in range(len(matches)):
+        j = max(j, i)
+        while j + 1 < len(matches) and matches[j + 1][1] - matches[i][0] <= window_chars:
+            j += 1
+        terms = {term for _, _, term in matches[i:j + 1]}
+        candidates.append((len(terms), j - i + 1, -i, i, j))
+    windows = []
+    for _, _, _, i, j in sorted(candidates, reverse=True):
+        # Centre the slack around the matched span and snap to word boundaries
+        slack = max(window_chars - (matches[j][1] - matches[i][0]), 0)
+        window_start = max(start, matches[i][0] - slack // 2)
+        window_end = min(end, matches[j][1] + slack - slack // 2)
+        space = text.find(" ", window_start, matches[i][0])
+        window_start = space + 1 if window_start > start and space != -1 else window_start
+        space = text.rfind(" ", matches[j][1], window_end)
+        window_end = space if window_end < end and space != -1 else window_end
+        if any(window_start < w["end"] and w["start"] < window_end for w in windows):
+            continue
+        # The slack can take in matches on either side of the scored span, so every match
+        # inside the window is marked, not only matches[i..j]
+        first = bisect_left(starts, window_start)
+        last = bisect_left(starts, window_end)
+        windows.append({"start": window_start, "end": window_end,
+                        "matches": [(m_start, m_end) for m_start, m_end, _ in matches[first:last]
+                                    if m_end <= window_end]})
+        if len(windows) >= max_windows:
+            break
+    return sorted(windows, key=lambda w: w["start"])
+
+def render_match_windows(text: str, windows: List[Dict[str, Any]]) -> str:
+    # Marks up only the window slices, so the cost depends on the windows, not the paper length
+    parts = []
+    for window in windows:
+        pieces = []
+        cursor = window["start"]
+        for m_start, m_end in window["matches"]:
+            pieces.append(text[cursor:m_start])
+            pieces.append(f"<mark>{text[m_start:m_end]}</mark>")
+            cursor = m_end
+        pieces.append(text[cursor:window["end"]])
+        parts.append("".join(pieces).strip())
+    return " … ".join(parts)
@@ -1,7 +1,8 @@
 import streamlit as st
 from typing import Tuple, List, Dict, Any
-from citation import extract_citations, format_citation
+from citation import extract_citations, format_citations
 from analysis import compare_papers
+from library import get_library
 
 def render_analysis_options() -> Tuple[str, List[str]]:
     st.subheader("Analysis Options")
@@ -15,20 +16,20 @@ def render_analysis_options() -> Tuple[str, List[str]]:
         )
     return output_format, focus_areas
 
-def render_analysis_results(analysis_results, chat_session):
+def render_analysis_results(analysis_results, model):
     for i, result in enumerate(analysis_results):
         st.subheader(f"Analysis of {result['name']}")
         st.markdown(result['analysis'])
         
         # Extract and display citations
-        citations = extract_citations(result['content'])
+        citations = extract_citations(get_library().get_paper(result['id'])['content'])
         if citations:
             citation_style = st.selectbox(
                 "Select citation style:", 
                 ("APA", "MLA", "Chicago"), 
                 key=f"citation_style_{i}"
             )
-            formatted_citations = [format_citation(c, citation_style) for c in citations]
+            formatted_citations = format_citations(citations, citation_style)
             st.subheader("Citations")
             for fc in formatted_citations:
                 st.write(fc)
@@ -38,7 +39,7 @@ def render_analysis_results(analysis_results, chat_session):
     # Comparative analysis
     if len(analysis_results) >= 2:
         st.subheader("Comparative Analysis")
-        comparative_analysis = compare_papers(chat_session, analysis_results)
+        comparative_analysis = compare_papers(model, analysis_results)
         
         if isinstance(comparative_analysis, str):
             st.write(comparative_analysis)
@@ -1,9 +1,19 @@
 import streamlit as st
-from citation import extract_citations, format_citation
-from analysis import analyze_papers, compare_papers, ask_question, summarize_paper, find_related_papers
-from pdf_utils import extract_text_from_pdf
-from semantic_search import perform_semantic_search, highlight_text
+from google.api_core import exceptions as google_exceptions
+from citation import extract_citations, extract_references, format_citations, export_bibtex, export_ris, CITATION_PARSER_VERSION
+from analysis import analyze_papers, analyze_papers_concurrently, compare_papers, summarize_paper, find_related_papers
+from llm_client import RequestScheduler, StreamTimer, get_response_cache, format_timing
+from pdf_utils import extract_pages_from_pdfs, join_pages, page_starts, DEFAULT_WORKERS
+from semantic_search import SearchIndex, DenseSearchIndex, best_match_windows, render_match_windows
+from rag import answer_question
+from citation_graph import CitationIndex
+from library import get_library
+from cache_utils import hash_text
+from metrics import metrics
+from minhash import DuplicateIndex, store_signature
+from comparison import ComparisonEngine
 import time
+import os
 
 def render_sidebar():
     with st.sidebar:
@@ -27,7 +37,6 @@ def render_sidebar():
             <div style="background-color: #004333; color: #b0e892; padding: 10px; border-radius: 5px;">
             • Reference management integration (Zotero, Mendeley)<br>
             • Automated literature review generation<br>
-            • Plagiarism detection and similarity checking<br>
             • Integration with academic databases (e.g., PubMed, arXiv)<br>
             • Collaborative research workspace<br>
             • Custom AI model fine-tuning for specific research domains<br>
@@ -55,6 +64,29 @@ def render_sidebar():
             st.session_state.max_tokens = max_tokens
             st.success(f"Max output tokens set to {max_tokens}. This will limit the length of AI-generated responses.")
 
+        # Concurrent model requests
+        if 'max_concurrency' not in st.session_state:
+            st.session_state.max_concurrency = 4
+        max_concurrency = st.number_input("Max Concurrent Requests", 1, 16, st.session_state.max_concurrency, 1)
+        if max_concurrency != st.session_state.max_concurrency:
+            st.session_state.max_concurrency = max_concurrency
+            st.success(f"Up to {max_concurrency} papers will be analyzed at once.")
+
+        if 'requests_per_minute' not in st.session_state:
+            st.session_state.requests_per_minute = 60
+        requests_per_minute = st.number_input("Requests per Minute", 1, 1000, st.session_state.requests_per_minute, 1)
+        if requests_per_minute != st.session_state.requests_per_minute:
+            st.session_state.requests_per_minute = requests_per_minute
+            st.success(f"Model requests will be limited to {requests_per_minute} per minute.")
+
+        # Context budget for question answering
+        if 'context_tokens' not in st.session_state:
+            st.session_state.context_tokens = 2000
+        context_tokens = st.number_input("Question Context Tokens", 500, 16000, st.session_state.context_tokens, 500)
+        if context_tokens != st.session_state.context_tokens:
+            st.session_state.context_tokens = context_tokens
+            st.success(f"Questions will include up to {context_tokens} tokens of retrieved paper excerpts.")
+
         # Citation Style
         if 'default_citation_style' not in st.session_state:
             st.session_state.default_citation_style = 'APA'
@@ -63,6 +95,20 @@ def render_sidebar():
             st.session_state.default_citation_style = citation_style
             st.success(f"Default citation style set to {citation_style}.")
 
+        # PDF Extraction Workers
+        if 'pdf_workers' not in st.session_state:
+            st.session_state.pdf_workers = DEFAULT_WORKERS
+        pdf_workers = st.number_input("PDF Extraction Workers", 1, os.cpu_count() or 1, min(st.session_state.pdf_workers, os.cpu_count() or 1), 1)
+        if pdf_workers != st.session_state.pdf_workers:
+            st.session_state.pdf_workers = pdf_workers
+            st.success(f"PDF extraction will use up to {pdf_workers} worker process(es).")
+
+        response_cache = get_response_cache().stats()
+        st.caption(f"Response cache: {response_cache['hits']} hits, {response_cache['misses']} misses, {response_cache['entries']} stored responses")
+        render_metrics_panel()
+
+        st.caption(f"Library: {len(get_library())} stored paper(s). Clearing data below keeps the library.")
+
         if st.button("Clear All Data", use_container_width=True):
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
@@ -74,36 +120,215 @@ def render_sidebar():
         st.markdown("[Report a bug](https://github.com/anubhab-m02/Research-Assistant-AI/issues)")
         st.markdown("[Suggest a feature](https://github.com/anubhab-m02/Research-Assistant-AI/issues)")
 
+def render_metrics_panel():
+    with st.expander("Performance Metrics"):
+        snapshot = metrics.snapshot()
+        stages = [s for s in snapshot["summaries"] if s["name"] in ("stage_seconds", "time_to_first_token_seconds")]
+        if stages:
+            st.table([
+                {
+                    "Stage": s["labels"].get("stage") or f"{s['labels'].get('task')} first token",
+                    "Calls": s["count"],
+                    "p50 (ms)": f"{s['p50'] * 1000:.1f}",
+                    "p95 (ms)": f"{s['p95'] * 1000:.1f}",
+                    "Total (s)": f"{s['sum']:.2f}",
+                }
+                for s in stages
+            ])
+        else:
+            st.caption("No timings recorded yet.")
+        prompt_tokens = metrics.counter("llm_tokens_total", kind="prompt")
+        response_tokens = metrics.counter("llm_tokens_total", kind="response")
+        st.caption(f"Model tokens: {prompt_tokens:,.0f} prompt, {response_tokens:,.0f} response")
+        for cache_name, ratio in metrics.cache_hit_ratios().items():
+            st.caption(f"{cache_name} cache: {ratio['hit_ratio']:.0%} hit ratio ({ratio['hit']:.0f} hits, {ratio['miss']:.0f} misses)")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Prometheus", metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain", use_container_width=True)
+        with col2:
+            st.download_button("JSON", metrics.to_json(), file_name="metrics.json", mime="application/json", use_container_width=True)
+
+def add_paper(name, content, starts=None):
+    # Papers are stored in the library; session state only keeps their ids
+    library = get_library()
+    paper_id = library.add_paper(name, content, starts)
+    # Only the document signature is indexed here; passages are indexed when Check
+    # Similarity or duplicate reuse first needs them
+    duplicate_index = load_duplicate_index()
+    signature = store_signature(library, paper_id, content, duplicate_index.hasher)
+    if signature is not None:
+        duplicate_index.add_signature(paper_id, signature)
+    return paper_id
+
+def remove_library_paper(paper_id):
+    # Deletes the paper and drops its signature from the session's duplicate index, so it
+    # is no longer offered as a near-duplicate of other papers
+    get_library().remove_paper(paper_id)
+    if st.session_state.get('duplicate_index') is not None:
+        st.session_state.duplicate_index.remove(paper_id)
+
+def add_pasted_paper(content):
+    # Each edit of the paste box replaces the row its previous text created, so drafts do
+    # not pile up in the library; text that was already stored is left alone
+    library = get_library()
+    created = hash_text(content) not in library
+    paper_id = add_paper("Pasted Content", content)
+    previous = st.session_state.get('pasted_paper_id')
+    if previous and previous != paper_id:
+        remove_library_paper(previous)
+        st.session_state.pasted_paper_id = None
+    if created:
+        st.session_state.pasted_paper_id = paper_id
+    return paper_id
+
+def get_papers():
+    return get_library().get_papers(st.session_state.paper_ids)
+
+COMPARISON_SECTIONS = {
+    "overview": "Overview",
+    "similarities": "Key Similarities",
+    "differences": "Notable Differences",
+    "future_research": "Potential Areas for Future Research",
+}
+
+SEARCH_BACKENDS = {
+    "Keyword (TF-IDF)": ("search_index", SearchIndex),
+    "Dense (local embeddings)": ("dense_index", DenseSearchIndex),
+}
+
+def get_search_index(backend="Keyword (TF-IDF)"):
+    # Indexes live in session state and are only updated for papers added or removed since the last query
+    state_key, index_class = SEARCH_BACKENDS[backend]
+    if st.session_state.get(state_key) is None:
+        st.session_state[state_key] = index_class()
+    index = st.session_state[state_key]
+    index.sync(get_papers())
+    return index
+
+# One scheduler per process and limit setting, so its token bucket paces every request
+# from every rerun and session against the same quota
+@st.cache_resource(show_spinner=False)
+def shared_scheduler(max_concurrency, requests_per_minute):
+    return RequestScheduler(max_concurrency=max_concurrency, requests_per_minute=requests_per_minute)
+
+def get_scheduler():
+    return shared_scheduler(st.session_state.max_concurrency, st.session_state.requests_per_minute)
+
+def get_comparison_engine():
+    # Keeps paper groups and their comparisons across reruns, so a redraw or one added
+    # paper only sends new or changed groups to the model
+    if st.session_state.get('comparison_engine') is None:
+        st.session_state.comparison_engine = ComparisonEngine()
+    return st.session_state.comparison_engine
+
+def load_duplicate_index():
+    # Seeded once per session with the signatures of every stored paper
+    if st.session_state.get('duplicate_index') is None:
+        index = DuplicateIndex()
+        for paper_id, signature in get_library().artifacts("minhash").items():
+            index.add_signature(paper_id, signature)
+        st.session_state.duplicate_index = index
+    return st.session_state.duplicate_index
+
+def get_duplicate_index():
+    # Loaded papers are also indexed passage by passage
+    index = load_duplicate_index()
+    index.sync(get_papers())
+    return index
+
+def plan_duplicate_reuse(papers, analysis_key):
+    # Splits papers into those to send to the model and near-duplicates whose analysis
+    # can be reused: from the library when a similar paper was analyzed with the same
+    # options, otherwise from a similar paper earlier in this batch
+    library = get_library()
+    duplicate_index = get_duplicate_index()
+    names = {paper['id']: paper['name'] for paper in library.list_papers()}
+    to_analyze = []
+    reused = {}
+    batch_duplicates = {}
+    for i, paper in enumerate(papers):
+        for match in duplicate_index.near_duplicates(paper['id']):
+            stored = library.get_artifact(match['paper_id'], "analysis", analysis_key)
+            if stored:
+                reused[i] = {"id": paper['id'], "name": paper['name'], "analysis": stored,
+                             "duplicate_of": names.get(match['paper_id'], match['paper_id']), "similarity": match['similarity']}
+                break
+            original = next((j for j in to_analyze if papers[j]['id'] == match['paper_id']), None)
+            if original is not None:
+                batch_duplicates[i] = (original, match['similarity'])
+                break
+        else:
+            to_analyze.append(i)
+    return to_analyze, reused, batch_duplicates
+
+def get_citation_index():
+    if st.session_state.get('citation_index') is None:
+        st.session_state.citation_index = CitationIndex()
+    index = st.session_state.citation_index
+    index.sync(get_papers())
+    return index
+
 def render_main_content():
     st.title("Enhanced Research Paper Analysis Assistant")
 
     # Paper input section
     st.header("Input Research Paper(s)")
     st.markdown("Upload your research papers or paste their content for analysis.")
-    input_method = st.radio("Choose input method:", ("Upload PDF", "Paste Text"))
+    input_method = st.radio("Choose input method:", ("Upload PDF", "Paste Text", "From Library"))
 
     if input_method == "Upload PDF":
         st.markdown("Upload one or more PDF files of research papers you want to analyze.")
         uploaded_files = st.file_uploader("Upload research paper(s) (PDF)", type="pdf", accept_multiple_files=True)
         if uploaded_files:
-            st.session_state.paper_contents = []
-            for uploaded_file in uploaded_files:
-                with st.spinner(f"Extracting text from {uploaded_file.name}..."):
-                    content = extract_text_from_pdf(uploaded_file)
-                    st.session_state.paper_contents.append({"name": uploaded_file.name, "content": content})
-    else:
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            completed = []
+
+            def on_file_done(index, pages, error):
+                completed.append(index)
+                name = uploaded_files[index].name
+                if error:
+                    st.error(f"Error extracting text from {name}: {error}")
+                elif not any(page.strip() for page in pages):
+                    st.warning(f"Warning: No text extracted from {name}. The PDF might be scanned or protected.")
+                status_text.text(f"Extracted {len(completed)} of {len(uploaded_files)}: {name}")
+                progress_bar.progress(len(completed) / len(uploaded_files))
+
+            with st.spinner(f"Extracting text from {len(uploaded_files)} file(s)..."):
+                extracted = extract_pages_from_pdfs(uploaded_files, max_workers=st.session_state.pdf_workers, progress_callback=on_file_done)
+            # Papers are keyed by their text, so files with identical text are loaded once
+            # under the first name, and the user is told which files were folded together
+            paper_ids = []
+            names_by_id = {}
+            for uploaded_file, pages in zip(uploaded_files, extracted):
+                content = join_pages(pages)
+                if not content.strip():
+                    # Failed or textless files were already reported and are not stored
+                    continue
+                paper_id = hash_text(content)
+                if paper_id in names_by_id:
+                    st.info(f"{uploaded_file.name} has the same text as {names_by_id[paper_id]}; it was loaded once.")
+                    continue
+                names_by_id[paper_id] = uploaded_file.name
+                paper_ids.append(add_paper(uploaded_file.name, content, page_starts(pages)))
+            st.session_state.paper_ids = paper_ids
+            status_text.empty()
+            progress_bar.empty()
+    elif input_method == "Paste Text":
         st.markdown("Paste the text content of a research paper you want to analyze.")
         paper_content = st.text_area("Paste your research paper content here:", height=300)
         if paper_content:
-            st.session_state.paper_contents = [{"name": "Pasted Content", "content": paper_content}]
+            st.session_state.paper_ids = [add_pasted_paper(paper_content)]
+    else:
+        render_library_picker()
 
-    if st.session_state.paper_contents:
-        st.write(f"Number of papers loaded: {len(st.session_state.paper_contents)}")
+    if st.session_state.paper_ids:
+        st.write(f"Number of papers loaded: {len(st.session_state.paper_ids)}")
 
     # Functionality selection
     st.header("Choose Functionality")
     functionality = st.selectbox("Select what you want to do:", 
-                                 ["Analyze Papers", "Extract Citations", "Semantic Search", "Ask Questions", "Find Related Papers", "Summarize Paper"])
+                                 ["Analyze Papers", "Extract Citations", "Semantic Search", "Ask Questions", "Find Related Papers", "Summarize Paper", "Check Similarity"])
 
     if functionality == "Analyze Papers":
         render_analysis_options()
@@ -117,6 +342,34 @@ def render_main_content():
         render_find_related_papers()
     elif functionality == "Summarize Paper":
         render_summarize_paper()
+    elif functionality == "Check Similarity":
+        render_check_similarity()
+
+def render_library_picker():
+    library = get_library()
+    st.markdown("Load papers you have uploaded before. Search matches words in paper titles and text.")
+    library_query = st.text_input("Search your library:", key="library_query")
+    if library_query:
+        matches = library.search(library_query)
+        for match in matches:
+            st.markdown(f"- **{match['name']}**: {match['snippet']}", unsafe_allow_html=True)
+        choices = {match['id']: match['name'] for match in matches}
+    else:
+        choices = {paper['id']: f"{paper['name']} ({paper['pages']} pages)" for paper in library.list_papers()}
+    if not choices:
+        st.info("No stored papers match." if library_query else "Your library is empty. Upload or paste a paper to add it.")
+        return
+    selected_ids = st.multiselect("Select papers:", list(choices), format_func=choices.get, key="library_selection")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Load Selected Papers", use_container_width=True, disabled=not selected_ids):
+            st.session_state.paper_ids = selected_ids
+    with col2:
+        if st.button("Remove from Library", use_container_width=True, disabled=not selected_ids):
+            for paper_id in selected_ids:
+                remove_library_paper(paper_id)
+            st.session_state.paper_ids = [paper_id for paper_id in st.session_state.paper_ids if paper_id not in selected_ids]
+            st.success(f"Removed {len(selected_ids)} paper(s) from the library.")
 
 def render_analysis_options():
     st.subheader("Analysis Options")
@@ -128,22 +381,68 @@ def render_analysis_options():
             ["Research Question", "Methodology", "Sample Size", "Key Findings", "Limitations", "Implications"],
             default=["Research Question", "Key Findings"]
         )
+    reuse_duplicates = st.checkbox("Reuse analyses of near-duplicate papers (e.g. preprint and published versions)", value=True)
 
     if st.button("🔍 Analyze Paper(s)", key="analyze_button"):
-        if st.session_state.paper_contents:
+        if st.session_state.paper_ids:
             st.session_state.analysis_results = []  # Clear previous results
-            total_papers = len(st.session_state.paper_contents)
+            get_comparison_engine().retry_failed()
+            all_papers = get_papers()
+            analysis_key = f"{output_format}:{','.join(focus_areas)}"
+            if reuse_duplicates:
+                to_analyze, reused, batch_duplicates = plan_duplicate_reuse(all_papers, analysis_key)
+            else:
+                to_analyze, reused, batch_duplicates = list(range(len(all_papers))), {}, {}
+            papers = [all_papers[i] for i in to_analyze]
+            total_papers = len(papers)
             progress_bar = st.progress(0)
             status_text = st.empty()
+            completed = []
 
-            for i, paper in enumerate(st.session_state.paper_contents):
-                status_text.text(f"Analyzing paper {i+1} of {total_papers}: {paper['name']}")
-                try:
-                    result = analyze_papers(st.session_state.chat_session, [paper], focus_areas, output_format)
-                    st.session_state.analysis_results.extend(result)
-                except Exception as e:
-                    st.error(f"Error analyzing {paper['name']}: {str(e)}")
-                progress_bar.progress((i + 1) / total_papers)
+            def on_paper_done(index, analysis, error):
+                completed.append(index)
+                name = papers[index]['name']
+                if error:
+                    st.error(f"Error analyzing {name}: {str(error)}")
+                elif not analysis:
+                    st.warning(f"No analysis generated for {name}")
+                status_text.text(f"Analyzed {len(completed)} of {total_papers}: {name}")
+                progress_bar.progress(len(completed) / total_papers)
+
+            status_text.text(f"Analyzing {total_papers} paper(s)...")
+            if reused or batch_duplicates:
+                st.info(f"{len(reused) + len(batch_duplicates)} paper(s) are near-duplicates of already analyzed papers and will reuse their analysis.")
+            if total_papers == 0:
+                pass
+            elif total_papers == 1:
+                # A single paper gains nothing from the scheduler, so stream its analysis instead
+                st.session_state.analysis_results = analyze_papers(
+                    st.session_state.model, papers, focus_areas, output_format, stream=True,
+                    scheduler=get_scheduler(),
+                )
+            else:
+                st.session_state.analysis_results = analyze_papers_concurrently(
+                    st.session_state.model, papers, focus_areas, output_format,
+                    scheduler=get_scheduler(), progress_callback=on_paper_done,
+                )
+
+            for result in st.session_state.analysis_results:
+                get_library().set_artifact(result['id'], "analysis", analysis_key, result['analysis'])
+            # Put reused analyses back in upload order alongside the fresh ones
+            by_id = {result['id']: result for result in st.session_state.analysis_results}
+            combined = []
+            for i, paper in enumerate(all_papers):
+                if i in reused:
+                    combined.append(reused[i])
+                elif i in batch_duplicates:
+                    original, similarity = batch_duplicates[i]
+                    source = by_id.get(all_papers[original]['id'])
+                    if source:
+                        combined.append(dict(source, id=paper['id'], name=paper['name'],
+                                             duplicate_of=source['name'], similarity=similarity))
+                elif paper['id'] in by_id:
+                    combined.append(by_id[paper['id']])
+            st.session_state.analysis_results = combined
 
             status_text.text("Analysis complete!")
             time.sleep(1)  # Give users a moment to see the "complete" message
@@ -154,7 +453,7 @@ def render_analysis_options():
 
     # Display analysis results
     if st.session_state.analysis_results:
-        render_analysis_results(st.session_state.analysis_results, st.session_state.chat_session)
+        render_analysis_results(st.session_state.analysis_results, st.session_state.model)
 
         # Save analysis button
         if st.button("💾 Save Analysis", key="save_analysis_button", use_container_width=True):
@@ -169,37 +468,52 @@ def render_analysis_options():
     else:
         st.info("No analysis results to display. Please analyze papers first.")
 
-def render_analysis_results(analysis_results, chat_session):
+def render_analysis_results(analysis_results, model):
     for i, result in enumerate(analysis_results):
         with st.expander(f"Analysis of {result['name']}", expanded=True):
+            if result.get('duplicate_of'):
+                st.caption(f"Reused the analysis of {result['duplicate_of']} ({result['similarity']:.0%} similar).")
             st.markdown(result['analysis'])
 
     # Comparative analysis
     if len(analysis_results) >= 2:
         with st.expander("Comparative Analysis", expanded=True):
             st.subheader("Comparative Analysis")
-            comparative_analysis = compare_papers(chat_session, analysis_results)
+            comparative_analysis = compare_papers(model, analysis_results, engine=get_comparison_engine(),
+                                                  index=get_search_index(), scheduler=get_scheduler())
             
             if isinstance(comparative_analysis, str):
                 st.write(comparative_analysis)
             else:
-                for section, content in comparative_analysis.items():
-                    if content:
-                        st.markdown(f"### {section.capitalize()}")
-                        st.write(content)
+                groups = [group for group in comparative_analysis["groups"] if len(group["papers"]) > 1]
+                if groups:
+                    st.caption(f"Papers were compared in {len(comparative_analysis['groups'])} group(s) of similar papers; "
+                               f"{comparative_analysis['requests']} comparison request(s) were needed for this update.")
+                for number, group in enumerate(comparative_analysis["groups"], start=1):
+                    theme = f": {group['theme']}" if group["theme"] else ""
+                    st.markdown(f"- **Group {number}** ({', '.join(group['papers'])}){theme}")
+                for section, title in COMPARISON_SECTIONS.items():
+                    if comparative_analysis[section]:
+                        st.markdown(f"### {title}")
+                        st.markdown(comparative_analysis[section])
 
 def render_semantic_search():
     st.subheader("Semantic Search")
     st.markdown("Search for specific information across all uploaded papers using natural language queries.")
     search_query = st.text_input("Enter your search query:")
-    if search_query and st.session_state.paper_contents:
-        corpus = [paper['content'] for paper in st.session_state.paper_contents]
-        search_results = perform_semantic_search(search_query, corpus)
-        st.subheader("Top Matching Papers")
+    st.session_state.search_top_k = st.slider("Number of passages to show", 1, 20, st.session_state.get('search_top_k', 5))
+    search_backend = st.radio("Search backend:", list(SEARCH_BACKENDS), horizontal=True)
+    if search_query and st.session_state.paper_ids:
+        search_results = get_search_index(search_backend).search(search_query, top_k=st.session_state.search_top_k)
+        papers_by_id = {paper['id']: paper for paper in get_papers()}
+        st.subheader("Top Matching Passages")
+        if not search_results:
+            st.info("No passages match your query.")
         for result in search_results:
-            paper = st.session_state.paper_contents[result['corpus_id']]
-            st.markdown(f"- **{paper['name']}** (Relevance: {result['score']:.2f})")
-            highlighted_text = highlight_text(paper['content'], search_query)
+            paper = papers_by_id[result['doc_id']]
+            st.markdown(f"- **{paper['name']}**, page {result['page']} (Relevance: {result['score']:.2f})")
+            windows = best_match_windows(paper['content'], search_query, result['start'], result['end'])
+            highlighted_text = render_match_windows(paper['content'], windows)
             st.markdown(highlighted_text, unsafe_allow_html=True)
 
 def render_ask_questions():
@@ -211,11 +525,26 @@ def render_ask_questions():
     
     question = st.text_input("Ask a new question about the paper(s):")
     if st.button("🤔 Ask Question", key="ask_question_button"):
-        if question and st.session_state.chat_session:
-            with st.spinner("Generating answer..."):
-                answer = ask_question(st.session_state.chat_session, question)
+        if question and st.session_state.qa_chat:
+            placeholder = st.empty()
+            timer = StreamTimer(lambda text: placeholder.markdown(f"**Answer:** {text}"), "question")
+            answer, sources = answer_question(
+                st.session_state.qa_chat,
+                get_search_index(),
+                get_papers(),
+                question,
+                max_tokens=st.session_state.context_tokens,
+                on_chunk=timer,
+            )
+            timing = timer.finish()
             if answer:
-                st.markdown(f"**Answer:** {answer}")
+                placeholder.markdown(f"**Answer:** {answer}")
+                st.caption(format_timing(timing))
+                if sources:
+                    with st.expander(f"Sources ({len(sources)} excerpts)"):
+                        for i, source in enumerate(sources, start=1):
+                            st.markdown(f"**[{i}] {source['name']}, p. {source['page']}** (Relevance: {source['score']:.2f})")
+                            st.write(source['text'])
                 st.session_state.chat_history.append((question, answer))
         elif not question:
             st.warning("Please enter a question before submitting.")
@@ -224,18 +553,36 @@ def render_ask_questions():
 
 def render_extract_citations():
     st.subheader("Extract Citations")
-    if st.session_state.paper_contents:
-        for i, paper in enumerate(st.session_state.paper_contents):
+    if st.session_state.paper_ids:
+        library = get_library()
+        for i, paper in enumerate(get_papers()):
             with st.expander(f"Citations from {paper['name']}", expanded=True):
-                citations = extract_citations(paper['content'])
+                citations_key = f"v{CITATION_PARSER_VERSION}"
+                citations = library.get_artifact(paper['id'], "citations", citations_key)
+                if citations is None:
+                    citations = extract_citations(paper['content'])
+                    library.set_artifact(paper['id'], "citations", citations_key, citations)
+                references = library.get_artifact(paper['id'], "references", citations_key)
+                if references is None:
+                    references = extract_references(paper['content'])
+                    library.set_artifact(paper['id'], "references", citations_key, references)
+                if references:
+                    st.caption(f"References section found with {len(references)} entries.")
                 if citations:
                     citation_style = st.selectbox(f"Select citation style for {paper['name']}:", 
                                                   ("APA", "MLA", "Chicago"), 
                                                   index=["APA", "MLA", "Chicago"].index(st.session_state.default_citation_style),
                                                   key=f"citation_style_{i}")
-                    formatted_citations = [format_citation(c, citation_style) for c in citations]
+                    formatted_citations = format_citations(citations, citation_style)
                     for j, fc in enumerate(formatted_citations):
                         st.markdown(f"{j+1}. {fc}")
+                    # Numeric citations point into the reference list, so export that instead of duplicating them
+                    export_records = [c for c in citations if c['type'] == 'author_year'] + references
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.download_button("Export BibTeX", export_bibtex(export_records), file_name=f"{paper['name']}.bib", mime="application/x-bibtex", key=f"bibtex_{i}")
+                    with col2:
+                        st.download_button("Export RIS", export_ris(export_records), file_name=f"{paper['name']}.ris", mime="application/x-research-info-systems", key=f"ris_{i}")
                 else:
                     st.write("No citations found in this paper.")
     else:
@@ -244,40 +591,102 @@ def render_extract_citations():
 def render_find_related_papers():
     st.subheader("Find Related Papers")
     if st.session_state.analysis_results:
-        with st.spinner("Finding related papers based on your analysis..."):
-            try:
-                related_papers = find_related_papers(st.session_state.chat_session, st.session_state.analysis_results)
-                
-                if related_papers:
-                    st.write("Related Papers:")
-                    for paper in related_papers:
-                        st.markdown(f"- [{paper['title']}]({paper['url']})")
-                else:
-                    st.warning("No related papers found. The AI model might not have generated suggestions in the expected format.")
-            except Exception as e:
-                st.error(f"An error occurred while finding related papers: {str(e)}")
+        # Rank candidates locally from the citation graph first; this needs no model call
+        citation_index = get_citation_index()
+        papers_by_id = {paper['id']: paper for paper in get_papers()}
+        analyzed_ids = [result['id'] for result in st.session_state.analysis_results]
+        frequently_cited = citation_index.most_cited(analyzed_ids, top_k=10)
+        if frequently_cited:
+            st.write("Works cited most often across your analyzed papers:")
+            for work in frequently_cited:
+                st.markdown(f"- {work['label']} (cited by {work['cited_by']} paper(s))")
+        for paper_id in analyzed_ids:
+            coupled = [c for c in citation_index.bibliographic_coupling(paper_id) if c['paper_id'] in papers_by_id]
+            if coupled and paper_id in papers_by_id:
+                related = ", ".join(f"{papers_by_id[c['paper_id']]['name']} ({c['shared_references']} shared references)" for c in coupled)
+                st.markdown(f"**{papers_by_id[paper_id]['name']}** shares references with: {related}")
+
+        if st.checkbox("Also ask the AI model for suggestions", value=True, key="related_papers_use_model"):
+            with st.spinner("Finding related papers based on your analysis..."):
+                try:
+                    related_papers = find_related_papers(
+                        st.session_state.model, st.session_state.analysis_results,
+                        [work['label'] for work in frequently_cited],
+                    )
+
+                    if related_papers:
+                        st.write("Related Papers:")
+                        for paper in related_papers:
+                            st.markdown(f"- [{paper['title']}]({paper['url']})")
+                    else:
+                        st.warning("No related papers found. The AI model might not have generated suggestions in the expected format.")
+                except Exception as e:
+                    st.error(f"An error occurred while finding related papers: {str(e)}")
     else:
         st.warning("Please analyze papers first before finding related papers.")
 
 def render_summarize_paper():
     st.subheader("Summarize Paper")
-    if st.session_state.paper_contents:
+    if st.session_state.paper_ids:
+        papers = get_papers()
         # Create a list of paper names
-        paper_names = [paper['name'] for paper in st.session_state.paper_contents]
+        paper_names = [paper['name'] for paper in papers]
         
         # Let the user select which paper to summarize
         selected_paper_name = st.selectbox("Select a paper to summarize:", paper_names)
         
         # Find the selected paper in the session state
-        selected_paper = next((paper for paper in st.session_state.paper_contents if paper['name'] == selected_paper_name), None)
+        selected_paper = next((paper for paper in papers if paper['name'] == selected_paper_name), None)
         
         if selected_paper:
+            saved_summary = get_library().get_artifact(selected_paper['id'], "summary")
+            if saved_summary:
+                with st.expander(f"Saved summary of {selected_paper_name}"):
+                    st.write(saved_summary)
             if st.button(f"Summarize {selected_paper_name}", key=f"summarize_{selected_paper_name}"):
+                st.markdown(f"**Summary of {selected_paper_name}:**")
+                placeholder = st.empty()
+                timer = StreamTimer(placeholder.markdown, "summary")
                 with st.spinner(f"Summarizing {selected_paper_name}..."):
-                    summary = summarize_paper(st.session_state.chat_session, selected_paper['content'])
-                    st.markdown(f"**Summary of {selected_paper_name}:**")
-                    st.write(summary)
+                    try:
+                        summary = summarize_paper(st.session_state.model, selected_paper['content'], get_scheduler(), timer)
+                    except google_exceptions.GoogleAPIError as e:
+                        st.error(f"An error occurred while summarizing the paper: {str(e)}")
+                        summary = None
+                    except Exception as e:
+                        st.error(f"An unexpected error occurred: {str(e)}")
+                        summary = None
+                placeholder.write(summary)
+                if summary:
+                    get_library().set_artifact(selected_paper['id'], "summary", "", summary)
+                st.caption(format_timing(timer.finish()))
         else:
             st.error("Selected paper not found. Please try again.")
     else:
-        st.warning("Please upload or paste paper content before summarizing.")
\ No newline at end of file
+        st.warning("Please upload or paste paper content before summarizing.")
+
+def render_check_similarity():
+    st.subheader("Check Similarity")
+    st.markdown("Find near-duplicate papers in your library and passages that overlap between the loaded papers.")
+    if st.session_state.paper_ids:
+        duplicate_index = get_duplicate_index()
+        papers = get_papers()
+        papers_by_id = {paper['id']: paper for paper in papers}
+        names = {paper['id']: paper['name'] for paper in get_library().list_papers()}
+        for paper in papers:
+            with st.expander(f"Similarity for {paper['name']}", expanded=True):
+                duplicates = duplicate_index.near_duplicates(paper['id'])
+                if duplicates:
+                    for match in duplicates:
+                        st.markdown(f"- Near-duplicate of **{names.get(match['paper_id'], match['paper_id'])}** ({match['similarity']:.0%} similar)")
+                else:
+                    st.write("No near-duplicate papers found.")
+                overlaps = duplicate_index.overlapping_passages(paper['id'])
+                if overlaps:
+                    st.write(f"{len(overlaps)} passage(s) overlap with other loaded papers:")
+                    for overlap in overlaps[:10]:
+                        other = papers_by_id[overlap['other_id']]
+                        st.markdown(f"- Page {overlap['page']} matches **{other['name']}**, page {overlap['other_page']} ({overlap['similarity']:.0%} similar)")
+                        st.caption(paper['content'][overlap['start']:overlap['end']][:300].strip() + " …")
+    else:
+        st.warning("Please upload or paste paper content before checking similarity.")